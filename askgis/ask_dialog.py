@@ -1,4 +1,4 @@
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 from qgis.core import QgsApplication, QgsAuthMethodConfig, QgsProject, QgsSettings
 from qgis.PyQt.QtWidgets import (
@@ -11,12 +11,14 @@ from qgis.PyQt.QtWidgets import (
     QWidget,
 )
 
-from askgis.ask_task import AskTask
-from askgis.lib.context import compute_context
+from askgis.lib.context import cached_context
 from askgis.lib.signaling_callback_handler import SignalingCallbackHandler
 from askgis.qgis_plugin_tools.tools.custom_logging import add_logger_msg_bar_to_widget
 from askgis.qgis_plugin_tools.tools.resources import ui_file_dialog
 
+if TYPE_CHECKING:
+    from askgis.ask_task import AskTask
+
 DialogUi = ui_file_dialog("ask-dialog.ui")  # type: Any
 
 
@@ -76,10 +78,13 @@ class AskDialog(DialogUi):
         self._callbacks.chain_start.connect(self.handle_chain_start)
         self._callbacks.chain_end.connect(self.handle_chain_end)
         self._callbacks.tool_end.connect(self.handle_tool_end)
+        self._callbacks.llm_error.connect(self.handle_error)
+        self._callbacks.chain_error.connect(self.handle_error)
+        self._callbacks.tool_error.connect(self.handle_error)
         self._callbacks.agent_action.connect(self.handle_agent_action)
         self._callbacks.agent_finish.connect(self.handle_agent_finish)
 
-        self._task: Optional[AskTask] = None
+        self._task: Optional["AskTask"] = None
 
     def _append_log(self, text: str):
         self.logEdit.setPlainText(self.logEdit.toPlainText() + text)
@@ -98,6 +103,12 @@ class AskDialog(DialogUi):
             f"\n{kwargs['observation_prefix']}{output}\n{kwargs['llm_prefix']}"
         )
 
+    def handle_error(self, error: BaseException, _kwargs: dict):
+        self._append_log(f"\nError: {error}\n")
+
+    def handle_profile(self, profile: str):
+        self._append_log(f"\nPlan profile:\n{profile}\n")
+
     def handle_agent_finish(self, _return_values: dict, log: str):
         self._append_log(log + "\n")
 
@@ -125,7 +136,10 @@ class AskDialog(DialogUi):
 
         self.progressBar.show()
 
-        context = compute_context(QgsProject.instance())
+        # imported on the first question, as it pulls in langchain
+        from askgis.ask_task import AskTask
+
+        context = cached_context(QgsProject.instance())
 
         self._task = AskTask(
             self.tr("OpenAI"),
@@ -138,6 +152,7 @@ class AskDialog(DialogUi):
         self._task.taskCompleted.connect(self.task_completed)
         self._task.codeChanged.connect(self.codeEdit.setPlainText)
         self._task.promptChanged.connect(self.promptEdit.setPlainText)
+        self._task.profileChanged.connect(self.handle_profile)
         self._task.progressChanged.connect(self.progressBar.setValue)
         QgsApplication.taskManager().addTask(self._task)
 
@@ -1,14 +1,17 @@
 from dataclasses import dataclass
 from typing import Optional
 
-from langchain import OpenAI
-from langchain.agents import AgentType, initialize_agent, load_tools
-from langchain.callbacks import BaseCallbackHandler, CallbackManager
+from langchain.agents import AgentType
+from langchain.callbacks import BaseCallbackHandler
 from PyQt5.QtCore import pyqtSignal
 from qgis.core import QgsProcessingFeedback, QgsTask
 
 from askgis.lib.chain import GISTool
 from askgis.lib.context import Context
+from askgis.lib.llm_cache import install_llm_cache, log_cache_stats
+from askgis.lib.runtime import RUNTIMES
+from askgis.lib.tracing import LATENCIES, Tracer, save_trace
+from askgis.lib.tracing_callback_handler import TracingCallbackHandler
 
 
 @dataclass
@@ -19,6 +22,7 @@ class AskResult:
 class AskTask(QgsTask):
     codeChanged = pyqtSignal(str)
     promptChanged = pyqtSignal(str)
+    profileChanged = pyqtSignal(str)
 
     def __init__(
         self,
@@ -35,6 +39,7 @@ class AskTask(QgsTask):
         self._api_key = api_key
         self._personality = personality
         self._callbacks = callbacks
+        self._tracer = Tracer()
         self._exception: Optional[Exception] = None
         self._result: Optional[AskResult] = None
 
@@ -43,32 +48,32 @@ class AskTask(QgsTask):
         return self._result
 
     def run(self) -> bool:
+        install_llm_cache()
         feedback = QgsProcessingFeedback()
         feedback.progressChanged.connect(self.setProgress)
 
         try:
-            llm = OpenAI(temperature=0, openai_api_key=self._api_key)
-
-            callback_manager = CallbackManager([self._callbacks])
-
+            runtime = RUNTIMES.get(
+                self._api_key, 0, AgentType.ZERO_SHOT_REACT_DESCRIPTION
+            )
             gis_tool = GISTool(
                 context=self._context,
-                llm=llm,
+                llm=runtime.llm,
                 feedback=feedback,
-                callback_manager=callback_manager,
+                callback_manager=runtime.callback_manager,
                 code_callback=self.codeChanged.emit,
                 prompt_callback=self.promptChanged.emit,
+                profile_callback=lambda profile: self.profileChanged.emit(
+                    profile.render()
+                ),
+                tracer=self._tracer,
             )
 
-            tools = load_tools(["llm-math"], llm=llm, callback_manager=callback_manager)
-            agent = initialize_agent(
-                [gis_tool, *tools],
-                llm,
-                AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-                verbose=True,
-                callback_manager=callback_manager,
-            )
-            answer = agent.run(self._question)
+            # the runtime is shared, only the callbacks are specific to this task
+            with runtime.callbacks.bound(
+                [self._callbacks, TracingCallbackHandler(self._tracer)]
+            ), self._tracer.span("question", "question"):
+                answer = runtime.executor([gis_tool]).run(self._question)
             self._result = AskResult(answer=answer)
             return True
         except Exception as e:
@@ -76,5 +81,8 @@ class AskTask(QgsTask):
             return False
 
     def finished(self, result: bool) -> None:
+        log_cache_stats()
+        save_trace(self._tracer)
+        LATENCIES.log()
         if not result and self._exception:
             raise self._exception
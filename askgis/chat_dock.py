@@ -1,16 +1,18 @@
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
-from langchain.memory import ChatMessageHistory, ConversationBufferMemory
-from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QLabel, QLineEdit, QPlainTextEdit, QPushButton, QWidget
 from qgis.core import QgsApplication, QgsProject
 from qgis.gui import QgsDockWidget
 
 from askgis.ask_dialog import get_api_key
-from askgis.chat_task import ChatTask
-from askgis.lib.context import compute_context
+from askgis.lib.context import cached_context
 from askgis.qgis_plugin_tools.tools.resources import load_ui
 
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+
+    from askgis.chat_task import ChatTask
+
 
 def ui_file_dock(*ui_file_name_parts: str):  # noqa ANN201
     """DRY helper for building classes from a .ui file"""
@@ -29,39 +31,6 @@ def ui_file_dock(*ui_file_name_parts: str):  # noqa ANN201
 DockUi = ui_file_dock("chat-dock-widget.ui")  # type: Any
 
 
-class SignalingChatMessageHistoryObject(QObject):
-    userMessage = pyqtSignal(str)
-    aiMessage = pyqtSignal(str)
-    clear = pyqtSignal()
-
-    def __init__(self, parent):
-        super().__init__(parent)
-
-
-class SignalingChatMessageHistory(ChatMessageHistory):
-    obj: SignalingChatMessageHistoryObject
-
-    class Config:
-        arbitrary_types_allowed = True
-
-    def __init__(self, *args, parent, **kwargs):
-        ChatMessageHistory.__init__(
-            self, *args, obj=SignalingChatMessageHistoryObject(parent), **kwargs
-        )
-
-    def add_user_message(self, message: str) -> None:
-        super().add_user_message(message)
-        self.obj.userMessage.emit(message)
-
-    def add_ai_message(self, message: str) -> None:
-        super().add_user_message(message)
-        self.obj.aiMessage.emit(message)
-
-    def clear(self) -> None:
-        super().clear()
-        self.obj.clear.emit()
-
-
 class ChatDock(DockUi):
     clearBtn: QPushButton
     messageEdit: QLineEdit
@@ -75,17 +44,33 @@ class ChatDock(DockUi):
         self.messageEdit.textChanged.connect(self.message_changed)
         self.message_changed()
 
-        history = SignalingChatMessageHistory(parent=self)
-        self._memory = ConversationBufferMemory(
-            memory_key="chat_history", chat_memory=history
-        )
-        history.obj.aiMessage.connect(self.handle_ai_message)
-        history.obj.userMessage.connect(self.handle_user_message)
-        history.obj.clear.connect(self.handle_clear)
+        self.clearBtn.clicked.connect(self.clear)
 
-        self.clearBtn.clicked.connect(history.obj.clear)
+        # created on the first message, as they pull in langchain
+        self._memory: Optional["ConversationBufferMemory"] = None
+        self._task: Optional["ChatTask"] = None
 
-        self._task: Optional[ChatTask] = None
+    @property
+    def memory(self) -> "ConversationBufferMemory":
+        if self._memory is None:
+            from langchain.memory import ConversationBufferMemory
+
+            from askgis.chat_task import SignalingChatMessageHistory
+
+            history = SignalingChatMessageHistory(parent=self)
+            self._memory = ConversationBufferMemory(
+                memory_key="chat_history", chat_memory=history
+            )
+            history.obj.aiMessage.connect(self.handle_ai_message)
+            history.obj.userMessage.connect(self.handle_user_message)
+            history.obj.clear.connect(self.handle_clear)
+        return self._memory
+
+    def clear(self):
+        if self._memory is None:
+            self.handle_clear()
+        else:
+            self._memory.chat_memory.clear()
 
     def handle_ai_message(self, message: str):
         self.chatEdit.setPlainText(self.chatEdit.toPlainText() + f"AI: {message}\n")
@@ -106,14 +91,16 @@ class ChatDock(DockUi):
             self.message_changed()
             return
 
-        context = compute_context(QgsProject.instance())
+        from askgis.chat_task import ChatTask
+
+        context = cached_context(QgsProject.instance())
 
         self._task = ChatTask(
             self.tr("OpenAI"),
             self.messageEdit.text().strip(),
             context=context,
             api_key=key,
-            memory=self._memory,
+            memory=self.memory,
         )
         self._task.taskCompleted.connect(self.task_completed)
         QgsApplication.taskManager().addTask(self._task)
@@ -1,15 +1,54 @@
 from dataclasses import dataclass
 from typing import Optional
 
-from langchain import OpenAI
-from langchain.agents import AgentType, initialize_agent, load_tools
-from langchain.agents.agent_toolkits import NLAToolkit
+from langchain.agents import AgentType
+from langchain.memory import ChatMessageHistory
 from langchain.schema import BaseMemory
 from langchain.tools.plugin import AIPlugin, AIPluginTool
-from qgis.core import QgsTask
+from PyQt5.QtCore import QObject, pyqtSignal
+from qgis.core import QgsSettings, QgsTask
 
 from askgis.lib.chain import GISTool
 from askgis.lib.context import Context
+from askgis.lib.llm_cache import install_llm_cache, log_cache_stats
+from askgis.lib.runtime import RUNTIMES
+from askgis.lib.tracing import LATENCIES, Tracer, save_trace
+from askgis.lib.tracing_callback_handler import TracingCallbackHandler
+
+DEFAULT_AI_PLUGIN_URL = "https://www.klarna.com/.well-known/ai-plugin.json"
+
+
+class SignalingChatMessageHistoryObject(QObject):
+    userMessage = pyqtSignal(str)
+    aiMessage = pyqtSignal(str)
+    clear = pyqtSignal()
+
+    def __init__(self, parent):
+        super().__init__(parent)
+
+
+class SignalingChatMessageHistory(ChatMessageHistory):
+    obj: SignalingChatMessageHistoryObject
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, *args, parent, **kwargs):
+        ChatMessageHistory.__init__(
+            self, *args, obj=SignalingChatMessageHistoryObject(parent), **kwargs
+        )
+
+    def add_user_message(self, message: str) -> None:
+        super().add_user_message(message)
+        self.obj.userMessage.emit(message)
+
+    def add_ai_message(self, message: str) -> None:
+        super().add_user_message(message)
+        self.obj.aiMessage.emit(message)
+
+    def clear(self) -> None:
+        super().clear()
+        self.obj.clear.emit()
 
 
 @dataclass
@@ -31,6 +70,7 @@ class ChatTask(QgsTask):
         self._context = context
         self._api_key = api_key
         self._memory = memory
+        self._tracer = Tracer()
         self._exception: Optional[Exception] = None
         self._result: Optional[ChatResult] = None
 
@@ -39,24 +79,29 @@ class ChatTask(QgsTask):
         return self._result
 
     def run(self) -> bool:
+        install_llm_cache()
         try:
-            llm = OpenAI(temperature=0.7, openai_api_key=self._api_key)
-
-            tools = load_tools(["llm-math"], llm=llm)
-            agent = initialize_agent(
+            runtime = RUNTIMES.get(
+                self._api_key, 0.7, AgentType.CONVERSATIONAL_REACT_DESCRIPTION
+            )
+            # a manifest URL or a local path, empty to not use any AI plugin
+            plugin_url = QgsSettings().value(
+                "/AskGIS/aiPluginUrl", DEFAULT_AI_PLUGIN_URL, type=str
+            )
+            plugin_tools = runtime.plugin_tools(plugin_url) if plugin_url else []
+            agent = runtime.executor(
                 [
-                    GISTool(context=self._context, llm=llm),
-                    *NLAToolkit.from_llm_and_ai_plugin_url(
-                        llm, "https://www.klarna.com/.well-known/ai-plugin.json"
-                    ).get_tools(),
-                    *tools,
+                    GISTool(
+                        context=self._context, llm=runtime.llm, tracer=self._tracer
+                    ),
+                    *plugin_tools,
                 ],
-                llm,
-                AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
                 memory=self._memory,
-                verbose=True,
             )
-            answer = agent.run(self._question)
+            with runtime.callbacks.bound(
+                [TracingCallbackHandler(self._tracer)]
+            ), self._tracer.span("chat message", "chat"):
+                answer = agent.run(self._question)
             self._result = ChatResult(answer=answer)
             return True
         except Exception as e:
@@ -64,5 +109,8 @@ class ChatTask(QgsTask):
             return False
 
     def finished(self, result: bool) -> None:
+        log_cache_stats()
+        save_trace(self._tracer)
+        LATENCIES.log()
         if not result and self._exception:
             raise self._exception
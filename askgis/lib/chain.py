@@ -1,4 +1,5 @@
-from typing import Any, Callable, Dict, List, Optional
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from langchain import BasePromptTemplate, LLMChain, PromptTemplate
 from langchain.chains.base import Chain
@@ -6,14 +7,15 @@ from langchain.schema import BaseLanguageModel, BaseOutputParser
 from langchain.tools import BaseTool
 from qgis.core import QgsProcessingFeedback
 
+from askgis import LOGGER
 from askgis.lib.context import Context
-from askgis.lib.executor import (
-    Action,
-    Executor,
-    action_functions,
-    get_prompt_functions,
-    to_action,
-)
+from askgis.lib.executor import Action, Executor, action_functions, get_prompt_functions
+from askgis.lib.optimizer import Optimizer
+from askgis.lib.parser import ParseError, to_action
+from askgis.lib.plan_cache import PLAN_CACHE
+from askgis.lib.profiling import ProfileNode, Profiler, profiling_enabled, save_profile
+from askgis.lib.sql import execute_in_database
+from askgis.lib.tracing import Tracer
 
 
 class PythonCodeActionParser(BaseOutputParser):
@@ -38,7 +40,7 @@ def func1() -> Action:
     Select buildings close to highways
     """
 
-    return select(intersection(get_layer('buildings_fasdff3234'), buffer(filter(get_layer('roads_fa4123'), 'type', 'highway'), 500)))
+    return select(within_distance(get_layer('buildings_fasdff3234'), filter(get_layer('roads_fa4123'), 'type', 'highway'), 500))
 
 def func2() -> Action:
     """
@@ -61,20 +63,18 @@ class GISChain(Chain):
     code_callback: Optional[Callable[[str], None]]
     prompt_callback: Optional[Callable[[str], None]]
     action_callback: Optional[Callable[[Action], None]]
+    profile_callback: Optional[Callable[[ProfileNode], None]] = None
+    tracer: Optional[Tracer] = None
+    optimizer: Optional[Optimizer] = None
     input_key: str = "question"  #: :meta private:
     output_key: str = "answer"  #: :meta private:
 
     def __init__(self, context: Context, llm: BaseLanguageModel, **data: Any):
+        # the layers are chosen per question, see _prompt_inputs
         prompt = PromptTemplate(
-            input_variables=["question"],
+            input_variables=["question", "layers", "functions"],
             template=PROMPT,
             output_parser=PythonCodeActionParser(),
-            partial_variables={
-                "layers": "\n".join(layer.prompt for layer in context.layers),
-                "functions": "\n".join(get_prompt_functions()).format(
-                    layer_names=", ".join(layer.name for layer in context.layers)
-                ),
-            },
         )
         super().__init__(**data, context=context, prompt=prompt, llm=llm)
 
@@ -86,26 +86,73 @@ class GISChain(Chain):
     def output_keys(self) -> List[str]:
         return [self.output_key]
 
-    def _call(self, inputs: Dict[str, str]) -> Dict[str, str]:
+    def _prompt_inputs(self, question: str) -> Dict[str, str]:
+        context = self.context.relevant(question)
+        return dict(
+            question=question,
+            layers=context.layers_prompt,
+            functions="\n".join(get_prompt_functions()).format(
+                layer_names=context.layer_names
+            ),
+        )
+
+    def _generate(self, question: str) -> Tuple[str, Action]:
+        prompt_inputs = self._prompt_inputs(question)
         if self.prompt_callback:
-            self.prompt_callback(
-                self.prompt.format(question=inputs[self.input_key]).strip()
-            )
+            self.prompt_callback(self.prompt.format(**prompt_inputs).strip())
 
         llm_executor = LLMChain(
             prompt=self.prompt, llm=self.llm, callback_manager=self.callback_manager
         )
-        self.callback_manager.on_text(inputs[self.input_key], verbose=self.verbose)
-        text = llm_executor.predict(question=inputs[self.input_key])
-        code, action = self.prompt.output_parser.parse_with_prompt(
-            text, self.prompt.format_prompt(question=inputs[self.input_key])
-        )
+        text = llm_executor.predict(**prompt_inputs)
         if self.code_callback:
-            self.code_callback(code)  # type: ignore
+            self.code_callback(text)
+        return self.prompt.output_parser.parse_with_prompt(
+            text, self.prompt.format_prompt(**prompt_inputs)
+        )
+
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, str]:
+        question = inputs[self.input_key]
+        self.callback_manager.on_text(question, verbose=self.verbose)
+
+        # repeated questions on unchanged layers do not need the LLM
+        cached = PLAN_CACHE.get(question, self.context.project)
+        if cached is not None:
+            code, action = cached
+            if self.code_callback:
+                self.code_callback(code)
+        else:
+            try:
+                _, action = self._generate(question)
+            except ParseError as e:
+                LOGGER.warning(f"Invalid generated code: {e}")
+                return {self.output_key: f"Could not perform the action: {e}"}
+
         if self.action_callback:
             self.action_callback(action)
-        executor = Executor(self.context.project, self.feedback)
-        result = executor.execute(action)
+        optimized = (self.optimizer or Optimizer()).optimize(
+            action, self.context.project
+        )
+        with (
+            self.tracer.span("execute_in_database", "database")
+            if self.tracer
+            else nullcontext()
+        ):
+            result = execute_in_database(self.context.project, optimized, self.context)
+        if result is None:
+            profiler = Profiler() if profiling_enabled() else None
+            executor = Executor(
+                self.context.project, self.feedback, self.context, profiler, self.tracer
+            )
+            result = executor.execute(optimized)
+            if profiler is not None and profiler.root is not None:
+                save_profile(question, profiler.root)
+                if self.profile_callback:
+                    self.profile_callback(profiler.root)
+
+        if cached is None:
+            # only plans that could be executed are worth reusing
+            PLAN_CACHE.put(question, action, self.context.project)
         return {self.output_key: result}
 
 
@@ -124,6 +171,8 @@ command ({', '.join(a.title() for a in action_functions.keys())})", followed by
     code_callback: Optional[Callable[[str], None]]
     prompt_callback: Optional[Callable[[str], None]]
     action_callback: Optional[Callable[[Action], None]]
+    profile_callback: Optional[Callable[[ProfileNode], None]] = None
+    tracer: Optional[Tracer] = None
 
     def _run(self, tool_input: str) -> str:
         chain = GISChain(
@@ -134,6 +183,8 @@ command ({', '.join(a.title() for a in action_functions.keys())})", followed by
             code_callback=self.code_callback,
             prompt_callback=self.prompt_callback,
             action_callback=self.action_callback,
+            profile_callback=self.profile_callback,
+            tracer=self.tracer,
         )
         return chain.run(tool_input)
 
@@ -1,8 +1,36 @@
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from functools import cached_property, partial
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from qgis.core import QgsCategorizedSymbolRenderer, QgsField, QgsProject, QgsVectorLayer
-from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsCategorizedSymbolRenderer,
+    QgsField,
+    QgsMapLayer,
+    QgsProject,
+    QgsSettings,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QObject, QVariant
+
+from askgis.lib.field_summaries import FIELD_SUMMARIES
+from askgis.lib.relevance import LAYER_NAME_WEIGHT, BM25Index, estimate_tokens, terms
+
+MAX_PROMPT_VALUES = 20
+"""Fields with more values than this only get the first ones listed in the prompt."""
+DEFAULT_MAX_PROMPT_LAYERS = 10
+DEFAULT_PROMPT_TOKEN_BUDGET = 1500
+
+
+def prompt_limits() -> Tuple[int, int]:
+    """The maximum number of layers and tokens to describe in a prompt, from the settings."""
+
+    settings = QgsSettings()
+    return (
+        settings.value("/AskGIS/maxPromptLayers", DEFAULT_MAX_PROMPT_LAYERS, type=int),
+        settings.value(
+            "/AskGIS/promptTokenBudget", DEFAULT_PROMPT_TOKEN_BUDGET, type=int
+        ),
+    )
 
 
 @dataclass
@@ -11,12 +39,23 @@ class ContextField:
     name: str
     type: QVariant.Type
     values: Optional[Dict[str, str]] = None
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
 
     @property
     def prompt(self) -> str:
         if self.values:
             # figure out a prompt that can take the (often more human-readable) values in the dict
-            type_prompt = "possible values are " + ", ".join(self.values.keys())
+            # long lists are cut, values are matched to the closest actual ones when executing
+            values = [str(v) for v in self.values.keys()]
+            if len(values) > MAX_PROMPT_VALUES:
+                type_prompt = "possible values include " + ", ".join(
+                    values[:MAX_PROMPT_VALUES]
+                )
+            else:
+                type_prompt = "possible values are " + ", ".join(values)
+        elif self.minimum is not None and self.maximum is not None:
+            type_prompt = f"is a number between {self.minimum} and {self.maximum}"
         elif self.type == QVariant.String:
             type_prompt = "is a string"
         elif self.type in (
@@ -36,6 +75,11 @@ class ContextField:
         else:
             return f"{self.id} (also known as {self.name}, {type_prompt})"
 
+    @property
+    def search_text(self) -> str:
+        values = " ".join(f"{k} {v}" for k, v in (self.values or {}).items())
+        return f"{self.id} {self.name} {values}"
+
 
 @dataclass
 class ContextLayer:
@@ -43,55 +87,218 @@ class ContextLayer:
     name: str
     fields: List[ContextField]
 
-    @property
+    @cached_property
     def prompt(self) -> str:
         fields = ", ".join(field.prompt for field in self.fields)
         #        return f"* {self.id} (also known as {self.name}, has attributes {fields})"
         return f"* {self.name} (has attributes {fields})"
 
+    @cached_property
+    def search_terms(self) -> List[str]:
+        return terms(self.name) * LAYER_NAME_WEIGHT + [
+            term for field in self.fields for term in terms(field.search_text)
+        ]
+
+    def relevant_fields(self, query: Set[str]) -> List[ContextField]:
+        # a single shared trigram is too weak, but a shared word always brings its trigrams
+        return [
+            field
+            for field in self.fields
+            if len(query.intersection(terms(field.search_text))) >= 2
+        ]
+
+    def with_fields(self, fields: List[ContextField]) -> "ContextLayer":
+        return ContextLayer(id=self.id, name=self.name, fields=fields)
+
 
 @dataclass
 class Context:
     layers: List[ContextLayer]
     project: QgsProject
 
+    @cached_property
+    def layers_prompt(self) -> str:
+        return "\n".join(layer.prompt for layer in self.layers)
 
-def compute_context(project: QgsProject) -> Context:
-    def process_layer(layer: QgsVectorLayer) -> ContextLayer:
-        def process_field(field: QgsField) -> ContextField:
-            field = ContextField(
-                id=field.name(), name=field.displayName(), type=field.type()
-            )
+    @cached_property
+    def layer_names(self) -> str:
+        return ", ".join(layer.name for layer in self.layers)
+
+    def field_labels(self, layer_id: str, field_id: str) -> Optional[Dict[str, str]]:
+        """The known values of the field, mapped to their labels."""
+
+        for layer in self.layers:
+            if layer.id == layer_id:
+                for field in layer.fields:
+                    if field.id == field_id:
+                        return field.values
+        return None
+
+    @cached_property
+    def index(self) -> BM25Index:
+        return BM25Index(layer.search_terms for layer in self.layers)
+
+    def relevant(
+        self,
+        question: str,
+        max_layers: Optional[int] = None,
+        token_budget: Optional[int] = None,
+    ) -> "Context":
+        """A context with only the layers (and fields) most relevant to question.
+
+        Layers are ranked using BM25 over their names, fields, aliases and values, and added
+        until max_layers or the token budget is reached. Layers that do not fit are described
+        with only the fields that match the question.
+        """
 
-            renderer = layer.renderer()
-            if (
-                isinstance(renderer, QgsCategorizedSymbolRenderer)
-                and renderer.classAttribute() == field.name
-            ):
-                field.values = {
-                    field: cat.label()
-                    for cat in renderer.categories()
-                    if not (isinstance(cat.value(), QVariant) and cat.value().isNull())
-                    for field in (
-                        cat.value() if isinstance(cat.value(), list) else [cat.value()]
-                    )
-                }
-
-            return field
-
-        return ContextLayer(
-            id=layer.id(),
-            name=layer.name(),
-            fields=[process_field(field) for field in layer.fields().toList()],
+        default_layers, default_budget = prompt_limits()
+        max_layers = default_layers if max_layers is None else max_layers
+        budget = default_budget if token_budget is None else token_budget
+
+        query = terms(question)
+        order = [i for i, _ in self.index.ranked(query)]
+        if not order:
+            # the question does not mention anything specific, let the model choose
+            order = list(range(len(self.layers)))
+
+        layers = []
+        for i in order[:max_layers]:
+            layer = self.layers[i]
+            cost = estimate_tokens(layer.prompt) + estimate_tokens(layer.name)
+            if cost > budget:
+                layer = layer.with_fields(layer.relevant_fields(set(query)))
+                cost = estimate_tokens(layer.prompt) + estimate_tokens(layer.name)
+                if cost > budget:
+                    continue
+            layers.append(layer)
+            budget -= cost
+        return Context(layers=layers, project=self.project)
+
+
+def compute_layer_context(layer: QgsVectorLayer) -> ContextLayer:
+    summaries = FIELD_SUMMARIES.get(layer)
+
+    def process_field(field: QgsField) -> ContextField:
+        field = ContextField(
+            id=field.name(), name=field.displayName(), type=field.type()
         )
 
+        # values from the renderer below take precedence, as they include labels
+        summary = summaries.get(field.id)
+        if summary is not None:
+            if summary.values:
+                field.values = {value: value for value in summary.values}
+            field.minimum, field.maximum = summary.minimum, summary.maximum
+
+        renderer = layer.renderer()
+        if (
+            isinstance(renderer, QgsCategorizedSymbolRenderer)
+            and renderer.classAttribute() == field.name
+        ):
+            field.values = {
+                field: cat.label()
+                for cat in renderer.categories()
+                if not (isinstance(cat.value(), QVariant) and cat.value().isNull())
+                for field in (
+                    cat.value() if isinstance(cat.value(), list) else [cat.value()]
+                )
+            }
+
+        return field
+
+    return ContextLayer(
+        id=layer.id(),
+        name=layer.name(),
+        fields=[process_field(field) for field in layer.fields().toList()],
+    )
+
+
+def compute_context(project: QgsProject) -> Context:
     ctx = Context(
         project=project,
         layers=[
-            process_layer(layer)
+            compute_layer_context(layer)
             for layer in project.mapLayers().values()
             if isinstance(layer, QgsVectorLayer)
         ],
     )
 
     return ctx
+
+
+class ContextCache(QObject):
+    """Keeps the context of a project, only recomputing the layers that have changed."""
+
+    def __init__(self, project: QgsProject):
+        super().__init__(project)
+        self._project = project
+        self._layers: Dict[str, ContextLayer] = {}
+        self._watched: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._context: Optional[Context] = None
+
+        project.layersAdded.connect(self._layers_added)
+        project.layersWillBeRemoved.connect(self._layers_removed)
+        project.cleared.connect(self._cleared)
+        self._layers_added(project.mapLayers().values())
+
+    @property
+    def project(self) -> QgsProject:
+        return self._project
+
+    def context(self) -> Context:
+        """The current context, the same object is returned as long as nothing changed."""
+
+        if self._context is None or self._dirty:
+            for layer_id in self._dirty:
+                layer = self._project.mapLayer(layer_id)
+                if isinstance(layer, QgsVectorLayer):
+                    self._layers[layer_id] = compute_layer_context(layer)
+                else:
+                    self._layers.pop(layer_id, None)
+            self._dirty.clear()
+            self._context = Context(
+                layers=list(self._layers.values()), project=self._project
+            )
+        return self._context
+
+    def invalidate(self, layer_id: str) -> None:
+        self._dirty.add(layer_id)
+
+    def _layers_added(self, layers: Iterable[QgsMapLayer]) -> None:
+        for layer in layers:
+            if not isinstance(layer, QgsVectorLayer):
+                continue
+            if layer.id() not in self._watched:
+                self._watched.add(layer.id())
+                invalidate = partial(self.invalidate, layer.id())
+                layer.nameChanged.connect(invalidate)
+                layer.rendererChanged.connect(invalidate)
+                layer.styleChanged.connect(invalidate)
+                layer.updatedFields.connect(invalidate)
+            # the layer is recomputed once the values of its fields are known
+            FIELD_SUMMARIES.ensure(layer, partial(self.invalidate, layer.id()))
+            self.invalidate(layer.id())
+
+    def _layers_removed(self, layer_ids: Iterable[str]) -> None:
+        for layer_id in layer_ids:
+            self._watched.discard(layer_id)
+            self.invalidate(layer_id)
+
+    def _cleared(self) -> None:
+        self._layers.clear()
+        self._watched.clear()
+        self._dirty.clear()
+        self._context = None
+
+
+_context_cache: Optional[ContextCache] = None
+
+
+def cached_context(project: QgsProject) -> Context:
+    """Get the context of the project from a cache that is kept up to date incrementally."""
+
+    global _context_cache
+    if _context_cache is None or _context_cache.project is not project:
+        _context_cache = ContextCache(project)
+    return _context_cache.context()
@@ -0,0 +1,51 @@
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsRectangle,
+    QgsUnitTypes,
+)
+
+WGS84 = QgsCoordinateReferenceSystem("EPSG:4326")
+UTM_ZONE_WIDTH = 6.0
+UTM_MAX_LATITUDE = 84.0
+
+
+def utm_zone(longitude: float) -> int:
+    return int((longitude + 180) / UTM_ZONE_WIDTH) % 60 + 1
+
+
+def metric_crs(
+    extent: QgsRectangle,
+    crs: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> QgsCoordinateReferenceSystem:
+    """Find a CRS in metres suitable for calculating distances within the given extent.
+
+    Returns crs itself if it already is in metres, otherwise the UTM zone of the extent, or an
+    azimuthal equidistant projection centered on the extent if it is too large for a single
+    UTM zone or too close to the poles.
+    """
+
+    if crs.mapUnits() == QgsUnitTypes.DistanceMeters:
+        return crs
+
+    if crs != WGS84:
+        extent = QgsCoordinateTransform(
+            crs, WGS84, transform_context
+        ).transformBoundingBox(extent)
+    center = extent.center()
+
+    if (
+        # -180 and 180 are in the same zone, so the width has to be checked as well
+        extent.width() < UTM_ZONE_WIDTH
+        and utm_zone(extent.xMinimum()) == utm_zone(extent.xMaximum())
+        and -UTM_MAX_LATITUDE < extent.yMinimum()
+        and extent.yMaximum() < UTM_MAX_LATITUDE
+    ):
+        epsg = (32600 if center.y() >= 0 else 32700) + utm_zone(center.x())
+        return QgsCoordinateReferenceSystem(f"EPSG:{epsg}")
+
+    return QgsCoordinateReferenceSystem.fromProj(
+        f"+proj=aeqd +lat_0={center.y()} +lon_0={center.x()} +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+    )
@@ -1,25 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass, fields
-from typing import List, Optional, Union, get_args, get_origin
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+)
 
-from langchain.python import PythonREPL
-from PyQt5.QtCore import QVariant
+from PyQt5.QtCore import Qt, QVariant
 from qgis import processing
 from qgis.core import (
+    QgsApplication,
     QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsExpression,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
+    QgsFields,
+    QgsMemoryProviderUtils,
     QgsProcessingFeedback,
     QgsProject,
+    QgsRectangle,
+    QgsSettings,
     QgsUnitTypes,
-    QgsVectorFileWriter,
     QgsVectorLayer,
     QgsWkbTypes,
 )
 
 from askgis import LOGGER
-from askgis.lib.util import to_snake_case
+from askgis.lib.context import Context
+from askgis.lib.crs import metric_crs
+from askgis.lib.layer_cache import LAYER_CACHE
+from askgis.lib.overlay import (
+    PreparedIndex,
+    count_difference,
+    distance_index,
+    ensure_spatial_index,
+    grid_partition,
+    intersecting_ids,
+    nearest_ids,
+    transformed_extent,
+    within_distance_ids,
+)
+from askgis.lib.profiling import AlgorithmRun, ProfileNode, Profiler
+from askgis.lib.text_index import TEXT_INDEX
+from askgis.lib.tracing import Span, Tracer
+from askgis.lib.util import CacheStats, to_snake_case
+from askgis.lib.value_index import resolve_values
+
+MAX_BRANCHES = min(8, os.cpu_count() or 1)
+BRANCHES = ThreadPoolExecutor(
+    max_workers=MAX_BRANCHES, thread_name_prefix="askgis-branch"
+)
+"""Threads for executing independent branches of plans."""
+
+DEFAULT_PARTITION_THRESHOLD = 1_000_000
+TILE_FEATURES = 100_000
+"""Roughly the number of input features per tile of a partitioned overlay."""
+
+T = TypeVar("T")
+
+
+def partition_threshold() -> int:
+    """Overlays of inputs with at least this many features are split in tiles, 0 never does."""
+
+    return QgsSettings().value(
+        "/AskGIS/partitionThreshold", DEFAULT_PARTITION_THRESHOLD, type=int
+    )
+
+
+def _structural_key(value: Any) -> Hashable:
+    if isinstance(value, Layer):
+        return value.key()
+    if isinstance(value, tuple):
+        return tuple(_structural_key(v) for v in value)
+    # include the type so that e.g. True and 1 do not end up with the same key
+    return type(value).__name__, value
 
 
 class Layer:
-    pass
+    def key(self) -> Hashable:
+        """A hashable key that is equal for structurally identical layer trees."""
+
+        return (
+            self.__class__.__name__,
+            *(_structural_key(getattr(self, f.name)) for f in fields(self)),
+        )
 
 
 @dataclass
@@ -36,6 +117,23 @@ class FilteredLayer(Layer):
     value: Union[str, float, int, bool]
 
 
+@dataclass
+class MultiValueFilteredLayer(Layer):
+    """Like FilteredLayer but matching any of several values, only produced by the optimizer."""
+
+    source: Layer
+    field: str
+    values: Tuple[Union[str, float, int, bool], ...]
+
+
+@dataclass
+class SearchLayer(Layer):
+    """Features of source whose text contains all words of query, words ending with * match any word starting with it"""
+
+    source: Layer
+    query: str
+
+
 @dataclass
 class BufferedLayer(Layer):
     source: Layer
@@ -57,6 +155,14 @@ class UnionLayer(BinaryOperationLayer):
         super().__init__(source, sources)
 
 
+def union_operands(layer: Layer) -> List[Layer]:
+    """The layers combined by a (nested) union, in order."""
+
+    if isinstance(layer, UnionLayer):
+        return [*union_operands(layer.source_a), *union_operands(layer.source_b)]
+    return [layer]
+
+
 class IntersectionLayer(BinaryOperationLayer):
     pass
 
@@ -65,6 +171,24 @@ class DifferenceLayer(BinaryOperationLayer):
     pass
 
 
+@dataclass
+class WithinDistanceLayer(Layer):
+    """Features of source within distance (in metres) of any feature of target."""
+
+    source: Layer
+    target: Layer
+    distance: float
+
+
+@dataclass
+class NearestLayer(Layer):
+    """The k features of source nearest to each feature of target."""
+
+    source: Layer
+    target: Layer
+    k: int
+
+
 class Action:
     pass
 
@@ -89,10 +213,13 @@ class CountAction(Action):
 layer_functions = dict(
     get_layer=SourceLayer,
     filter=FilteredLayer,
+    search=SearchLayer,
     buffer=BufferedLayer,
     union=UnionLayer,
     intersection=IntersectionLayer,
     difference=DifferenceLayer,
+    within_distance=WithinDistanceLayer,
+    nearest=NearestLayer,
 )
 action_functions = dict(
     select=SelectAction, add_to_map=AddToMapAction, count=CountAction
@@ -122,27 +249,38 @@ def get_prompt_functions() -> List[str]:
     return [function_def(k, v) for k, v in functions.items()]
 
 
-def to_action(python: str) -> Optional[Action]:
-    """Execute the Python code to collect a list of actions and their layer "trees"."""
+def rebuild(node: Union[Layer, Action], **changes: Any) -> Union[Layer, Action]:
+    """Create a copy of a layer or action with some of its fields replaced."""
+
+    # passing the fields positionally also works for UnionLayer's custom constructor
+    return node.__class__(
+        *(changes.get(f.name, getattr(node, f.name)) for f in fields(node))
+    )
 
-    actions: List[Action] = []
 
-    def make_action_func(type):
-        def func(*args, **kwargs):
-            actions.append(type(*args, **kwargs))
+def function_name(node: Union[Layer, Action]) -> str:
+    names = {v: k for k, v in functions.items()}
+    return names.get(node.__class__, to_snake_case(node.__class__.__name__))
 
-        return func
 
-    funcs = dict(
-        **layer_functions,
-        **{k: make_action_func(v) for k, v in action_functions.items()},
+def to_code(node: Union[Layer, Action]) -> str:
+    """Render a layer or action as the Python code that would have produced it."""
+
+    args = ", ".join(
+        to_code(value) if isinstance(value, (Layer, Action)) else repr(value)
+        for value in (getattr(node, f.name) for f in fields(node))
     )
+    return f"{function_name(node)}({args})"
+
 
-    out = PythonREPL(_globals=funcs, _locals=funcs).run(python.lstrip())
-    if out.strip():
-        LOGGER.warning(f"Error while executing Python for actions: {out}")
+def describe(node: Union[Layer, Action]) -> str:
+    """Like to_code, but leaving out the layers the node is made from."""
 
-    return actions[0] if len(actions) > 0 else None
+    args = ", ".join(
+        "..." if isinstance(value, (Layer, Action)) else repr(value)
+        for value in (getattr(node, f.name) for f in fields(node))
+    )
+    return f"{function_name(node)}({args})"
 
 
 @dataclass
@@ -151,111 +289,537 @@ class VectorData:
     """The original layer from which this data is derived. Useful to perform selection."""
     data: QgsVectorLayer
     """The data, might be the original layer or some derived layer (buffered, etc.)."""
+    expression: Optional[str] = None
+    """A filter expression that has not yet been applied to data."""
+    fids: Optional[Set[int]] = None
+    """If set, only these features of data are part of the result."""
+
+    def request(self) -> QgsFeatureRequest:
+        """A feature request for the features of data matching the expression and ids."""
+
+        if self.fids is not None and self.expression:
+            # a request can only filter by either ids or an expression
+            return QgsFeatureRequest(
+                QgsExpression(
+                    _and_expressions(
+                        f"$id IN ({', '.join(str(fid) for fid in self.fids) or 'NULL'})",
+                        self.expression,
+                    )
+                )
+            )
+        request = QgsFeatureRequest()
+        if self.fids is not None:
+            request.setFilterFids(list(self.fids))
+        elif self.expression:
+            request.setFilterExpression(self.expression)
+        return request
+
+    def known_count(self) -> Optional[int]:
+        """The number of matching features, if it is known without fetching them."""
+
+        if self.expression:
+            return None
+        if self.fids is not None:
+            return len(self.fids)
+        count = self.data.featureCount()
+        return count if count >= 0 else None
+
+
+def _and_expressions(*expressions: Optional[str]) -> Optional[str]:
+    expressions = tuple(e for e in expressions if e)
+    if not expressions:
+        return None
+    if len(expressions) == 1:
+        return expressions[0]
+    return " AND ".join(f"({e})" for e in expressions)
+
+
+ORIGIN_FID_FIELD = "__askgis_fid"
+"""Attribute holding the id of the original feature in derived layers."""
+
+
+def _copy_with_origin_fids(
+    layer: QgsVectorLayer, request: QgsFeatureRequest
+) -> QgsVectorLayer:
+    fields = QgsFields(layer.fields())
+    fields.append(QgsField(ORIGIN_FID_FIELD, QVariant.LongLong))
+    result = QgsMemoryProviderUtils.createMemoryLayer(
+        layer.name(), fields, layer.wkbType(), layer.crs()
+    )
+
+    features = []
+    for feature in layer.getFeatures(request):
+        copy = QgsFeature(fields)
+        copy.setGeometry(feature.geometry())
+        copy.setAttributes([*feature.attributes(), feature.id()])
+        features.append(copy)
+    result.dataProvider().addFeatures(features)
+    return result
+
+
+def _coalesce_origin_fids(layer: QgsVectorLayer, other_fields: List[int]) -> None:
+    """Fill in the missing original feature ids of a memory layer from other fields."""
+
+    field_idx = layer.fields().lookupField(ORIGIN_FID_FIELD)
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes([field_idx, *other_fields])
+    changes = {}
+    for feature in layer.getFeatures(request):
+        if isinstance(feature.attribute(field_idx), int):
+            continue
+        fid = next(
+            (
+                feature.attribute(idx)
+                for idx in other_fields
+                if isinstance(feature.attribute(idx), int)
+            ),
+            None,
+        )
+        if fid is not None:
+            changes[feature.id()] = {field_idx: fid}
+    if changes:
+        layer.dataProvider().changeAttributeValues(changes)
+
+
+def find_layer(project: QgsProject, id: str) -> QgsVectorLayer:
+    """Find a layer by its id, name or short name."""
+
+    layer = next(
+        (
+            l
+            for l in project.mapLayers().values()
+            if l.id() == id
+            or l.name().lower() == id.lower()
+            or l.shortName().lower() == id.lower()
+        ),
+        None,
+    )
+    if not layer:
+        raise FileNotFoundError(f"Unknown layer: {id}")
+    return layer
+
+
+def coerce_value(data: QgsVectorLayer, field: str, value: Any) -> Any:
+    """Coerce a value given by the LLM to something matching the type of the field."""
+
+    field_idx = data.fields().lookupField(field)
+    if field_idx < 0:
+        raise KeyError(f"Unknown field: {field}")
+    field_type = data.fields().field(field_idx).type()
+    field_type_is_int = field_type in (
+        QVariant.Int,
+        QVariant.UInt,
+        QVariant.LongLong,
+        QVariant.ULongLong,
+    )
+    # some type coercions
+    if (
+        field_type_is_int
+        and isinstance(value, str)
+        and value.lower() in ("true", "yes")
+    ):
+        value = 1
+    elif (
+        field_type_is_int
+        and isinstance(value, str)
+        and value.lower() in ("false", "no")
+    ):
+        value = 0
+    elif field_type_is_int and isinstance(value, bool):
+        value = 1 if value else 0
+    return value
 
 
 class Executor:
     """Executes actions on the data available in the given project."""
 
-    def __init__(self, project: QgsProject, feedback: QgsProcessingFeedback):
+    def __init__(
+        self,
+        project: QgsProject,
+        feedback: QgsProcessingFeedback,
+        context: Optional[Context] = None,
+        profiler: Optional[Profiler] = None,
+        tracer: Optional[Tracer] = None,
+    ):
         self._project = project
-        self._feedback = feedback
+        self._root_feedback = feedback
+        self._context = context
+        self._memo: Dict[Hashable, VectorData] = {}
+        self._memo_lock = threading.Lock()
+        self._local = threading.local()
+        self._profiler = profiler
+        self._tracer = tracer
+        self.cache_stats = CacheStats()
+
+    @property
+    def _feedback(self) -> Optional[QgsProcessingFeedback]:
+        """The feedback of the branch being executed by the current thread."""
+
+        return getattr(self._local, "feedback", self._root_feedback)
+
+    @contextmanager
+    def _branch_feedback(
+        self, parent: Optional[QgsProcessingFeedback]
+    ) -> Iterator[None]:
+        previous = self._feedback
+        feedback = None
+        if parent is not None:
+            feedback = QgsProcessingFeedback()
+            # branches do not run an event loop, so the signal has to be delivered directly
+            parent.canceled.connect(feedback.cancel, Qt.DirectConnection)
+            if parent.isCanceled():
+                feedback.cancel()
+        self._local.feedback = feedback
+        try:
+            yield
+        finally:
+            self._local.feedback = previous
+            if parent is not None:
+                parent.canceled.disconnect(feedback.cancel)
 
     def execute(self, action: Action) -> str:
         """Execute a single action."""
 
-        return self._execute_action(action)
+        # memoized layers are only valid for the plan they were computed for
+        self._memo.clear()
+        self.cache_stats = CacheStats()
+        try:
+            return self._execute_action(action)
+        finally:
+            LOGGER.info(
+                f"Layer cache: {self.cache_stats.hits} hits, {self.cache_stats.misses} misses"
+            )
+
+    @contextmanager
+    def _instrument(
+        self, node: Union[Layer, Action]
+    ) -> Iterator[Optional[ProfileNode]]:
+        """Trace and profile the execution of the node, if enabled."""
+
+        with (
+            self._tracer.span(describe(node), f"executor:{function_name(node)}")
+            if self._tracer
+            else nullcontext()
+        ), (
+            self._profiler.node(describe(node)) if self._profiler else nullcontext()
+        ) as profile:
+            yield profile
 
     def _execute_layer(self, layer: Layer) -> VectorData:
-        return getattr(self, f"_execute_{to_snake_case(layer.__class__.__name__)}")(
-            layer
+        key = layer.key()
+        with self._memo_lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self.cache_stats.hits += 1
+            else:
+                self.cache_stats.misses += 1
+
+        if result is not None:
+            if self._profiler is not None:
+                profile = self._profiler.add(describe(layer))
+                profile.cached = True
+                profile.output_features = result.known_count()
+            return result
+
+        with self._instrument(layer) as profile:
+            result = getattr(
+                self, f"_execute_{to_snake_case(layer.__class__.__name__)}"
+            )(layer)
+        if profile is not None:
+            profile.output_features = result.known_count()
+        with self._memo_lock:
+            self._memo[key] = result
+        return result
+
+    def _execute_layers(self, *layers: Layer) -> List[VectorData]:
+        """Execute several layers, at the same time if they do not share any source layer.
+
+        That way every QGIS layer is only used by one thread at a time. Each branch gets its
+        own feedback, which is canceled together with the feedback of the executor.
+        """
+
+        if not self._independent(layers):
+            return [self._execute_layer(layer) for layer in layers]
+        return self._parallel([partial(self._execute_layer, layer) for layer in layers])
+
+    def _parallel(self, calls: List[Callable[[], T]]) -> List[T]:
+        """Run the calls at the same time, each as a branch with its own feedback."""
+
+        parent = self._feedback
+        profile = self._profiler.current() if self._profiler else None
+        span = self._tracer.current() if self._tracer else None
+        futures = [
+            BRANCHES.submit(self._run_branch, call, parent, profile, span)
+            for call in calls[1:]
+        ]
+        try:
+            results = [self._run_branch(calls[0], parent, profile, span)]
+            for future, call in zip(futures, calls[1:]):
+                # if no thread picked it up yet (they might all be busy with the branches
+                # waiting for it) it is run here instead
+                if future.cancel():
+                    results.append(self._run_branch(call, parent, profile, span))
+                else:
+                    results.append(future.result())
+            return results
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _run_branch(
+        self,
+        call: Callable[[], T],
+        parent: Optional[QgsProcessingFeedback],
+        profile: Optional[ProfileNode],
+        span: Optional[Span],
+    ) -> T:
+        with self._branch_feedback(parent), (
+            self._profiler.branch(profile) if self._profiler else nullcontext()
+        ), (self._tracer.branch(span) if self._tracer else nullcontext()):
+            return call()
+
+    def _independent(self, layers: Tuple[Layer, ...]) -> bool:
+        if len(layers) < 2:
+            return False
+        seen: Set[str] = set()
+        for layer in layers:
+            try:
+                ids = self._source_layer_ids(layer)
+            except FileNotFoundError:
+                # reported when it is executed
+                return False
+            if seen & ids:
+                return False
+            seen |= ids
+        return True
+
+    def _source_layer_ids(self, layer: Layer) -> Set[str]:
+        if isinstance(layer, SourceLayer):
+            return {find_layer(self._project, layer.id).id()}
+        return set().union(
+            *(
+                self._source_layer_ids(value)
+                for value in (getattr(layer, f.name) for f in fields(layer))
+                if isinstance(value, Layer)
+            )
         )
 
     def _execute_source_layer(self, layer: SourceLayer) -> VectorData:
-        original = next(
-            (
-                l
-                for l in self._project.mapLayers().values()
-                if l.id() == layer.id
-                or l.name().lower() == layer.id.lower()
-                or l.shortName().lower() == layer.id.lower()
-            ),
-            None,
-        )
-        if not original:
-            raise FileNotFoundError(f"Unknown layer: {layer.id}")
+        original = find_layer(self._project, layer.id)
         LOGGER.warning(f"Source layer {layer.id} has {original.featureCount()} items")
         return VectorData(original=original, data=original)
 
     def _execute_filtered_layer(self, layer: FilteredLayer) -> VectorData:
         source = self._execute_layer(layer.source)
+        return self._filter_by_values(source, layer.field, [layer.value])
 
-        field_idx = source.data.fields().lookupField(layer.field)
-        if field_idx < 0:
-            raise KeyError(f"Unknown field: {layer.field}")
-        field_type = source.data.fields().field(field_idx).type()
-        field_type_is_int = field_type in (
-            QVariant.Int,
-            QVariant.UInt,
-            QVariant.LongLong,
-            QVariant.ULongLong,
+    def _execute_multi_value_filtered_layer(
+        self, layer: MultiValueFilteredLayer
+    ) -> VectorData:
+        source = self._execute_layer(layer.source)
+        return self._filter_by_values(source, layer.field, list(layer.values))
+
+    def _filter_by_values(
+        self, source: VectorData, field: str, values: List[Any]
+    ) -> VectorData:
+        values = [coerce_value(source.data, field, value) for value in values]
+        if source.original.fields().lookupField(field) >= 0:
+            # the LLM does not necessarily know the exact spelling of the values
+            values = resolve_values(
+                source.original,
+                field,
+                values,
+                self._context.field_labels(source.original.id(), field)
+                if self._context
+                else None,
+            )
+
+        if len(values) == 1:
+            expression = QgsExpression.createFieldEqualityExpression(field, values[0])
+        else:
+            expression = f"{QgsExpression.quotedColumnRef(field)} IN ({', '.join(QgsExpression.quotedValue(v) for v in values)})"
+        return self._filter(source, expression)
+
+    def _execute_search_layer(self, layer: SearchLayer) -> VectorData:
+        source = self._execute_layer(layer.source)
+        fids = TEXT_INDEX.search(source.original, layer.query)
+        if fids and source.original.subsetString():
+            # the index is not maintained for the subset, only keep matches within it
+            request = QgsFeatureRequest()
+            request.setFilterFids(list(fids))
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setNoAttributes()
+            fids = {feature.id() for feature in source.original.getFeatures(request)}
+        LOGGER.warning(f"Search for {layer.query!r} matched {len(fids)} features")
+
+        if source.data is not source.original:
+            # derived data, match on the ids of the original features
+            return self._filter(
+                source,
+                f"{QgsExpression.quotedColumnRef(ORIGIN_FID_FIELD)} IN ({', '.join(str(fid) for fid in fids) or 'NULL'})",
+            )
+        return VectorData(
+            original=source.original,
+            data=source.data,
+            expression=source.expression,
+            fids=fids if source.fids is None else source.fids & fids,
+        )
+
+    def _filter(self, source: VectorData, expression: str) -> VectorData:
+        # filters are not applied here, instead they are combined and only applied once
+        # a concrete layer is needed, which allows the provider to use its indexes
+        expression = _and_expressions(source.expression, expression)
+        LOGGER.warning(f"Filtering {source.data.name()} by {expression}")
+        return VectorData(
+            original=source.original,
+            data=source.data,
+            expression=expression,
+            fids=source.fids,
         )
-        value = layer.value
-        # some type coercions
+
+    def _materialize(
+        self, data: VectorData, rect: Optional[QgsRectangle] = None
+    ) -> QgsVectorLayer:
+        """Get a concrete layer containing only the matching features, optionally only those in rect.
+
+        Layers made from the original layer get an extra attribute with the original feature
+        id, which is carried through the processing algorithms to be used for selection.
+        """
+
+        derived = data.data is not data.original
+        if derived and rect is None and data.fids is None and not data.expression:
+            return data.data
+
         if (
-            field_type_is_int
-            and isinstance(value, str)
-            and value.lower() in ("true", "yes")
-        ):
-            value = 1
-        elif (
-            field_type_is_int
-            and isinstance(value, str)
-            and value.lower() in ("false", "no")
+            not derived
+            and rect is None
+            and data.fids is None
+            and data.data.providerType() != "memory"
+            and (not data.expression or data.data.dataProvider().supportsSubsetString())
         ):
-            value = 0
-        elif field_type_is_int and isinstance(value, bool):
-            value = 1 if value else 0
+            # a view on the original data, the provider does the actual filtering
+            view = data.data.clone()
+            view.addExpressionField(
+                "$id", QgsField(ORIGIN_FID_FIELD, QVariant.LongLong)
+            )
+            if not data.expression:
+                return view
+            subset = _and_expressions(data.data.subsetString(), data.expression)
+            if view.setSubsetString(subset):
+                return view
+            LOGGER.warning(f"Provider could not handle subset string {subset}")
+
+        request = data.request()
+        if rect is not None:
+            request.setFilterRect(rect)
+        if derived:
+            result = data.data.materialize(request)
+        else:
+            result = _copy_with_origin_fids(data.data, request)
+        ensure_spatial_index(result)
+        if self._profiler is not None:
+            self._profiler.record_memory_layer(result.featureCount())
+        return result
 
-        result = self._run_processing(
-            "native:extractbyattribute",
-            dict(
-                INPUT=source.data,
-                FIELD=layer.field,
-                OPERATOR=0,  # equals
-                VALUE=f"{value}",
-                OUTPUT="memory:",
-            ),
-        )
-        LOGGER.warning(
-            f"Filter went from {source.data.featureCount()} to {result['OUTPUT'].featureCount()} features"
-        )
-        return VectorData(original=source.original, data=result["OUTPUT"])
+    def _origin_fids(self, data: VectorData) -> Set[int]:
+        """Ids of the features of the original layer that the data is derived from."""
 
-    def _execute_buffered_layer(self, layer: BufferedLayer) -> VectorData:
-        source = self._execute_layer(layer.source)
+        if data.data is data.original and data.fids is not None and not data.expression:
+            return data.fids
 
-        if source.data.crs().mapUnits() != QgsUnitTypes.DistanceMeters:
+        request = data.request()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        if data.data is data.original:
+            request.setNoAttributes()
+            return {f.id() for f in data.data.getFeatures(request)}
+
+        field_idx = data.data.fields().lookupField(ORIGIN_FID_FIELD)
+        if field_idx < 0:
+            raise KeyError(f"Cannot find the original features of {data.data.name()}")
+        request.setSubsetOfAttributes([field_idx])
+        return {
+            fid
+            for fid in (f.attribute(field_idx) for f in data.data.getFeatures(request))
+            # features that do not come from the original layer, e.g. from the other layer in a union
+            if isinstance(fid, int)
+        }
+
+    def _metric_crs(
+        self, layer: QgsVectorLayer, *others: QgsVectorLayer
+    ) -> QgsCoordinateReferenceSystem:
+        extent = layer.extent()
+        for other in others:
+            extent.combineExtentWith(
+                transformed_extent(other, layer, self._project.transformContext())
+            )
+        crs = metric_crs(extent, layer.crs(), self._project.transformContext())
+        if crs != layer.crs():
             LOGGER.warning(
-                f"Cannot handle distance unit {source.data.crs().mapUnits()}, reprojecting to SWEREF99TM, this will only make sense in Sweden"
+                f"Cannot handle distance unit {QgsUnitTypes.toString(layer.crs().mapUnits())}, using {crs.description() or crs.toProj()}"
             )
-            result = self._run_processing(
+        return crs
+
+    def _cache_key(self, layer: Layer, data: VectorData) -> Tuple[Hashable, ...]:
+        """Identifies the data of layer across questions, for caching on the original layer.
+
+        Derived layers are created anew by every question, so instead the plan of the layer is
+        used, together with the revisions of any other layers it uses.
+        """
+
+        return (
+            layer.key(),
+            tuple(
+                sorted(
+                    (layer_id, LAYER_CACHE.revision(self._project.mapLayer(layer_id)))
+                    for layer_id in self._source_layer_ids(layer)
+                    if layer_id != data.original.id()
+                )
+            ),
+        )
+
+    def _reproject(
+        self, layer: Layer, data: VectorData, crs: QgsCoordinateReferenceSystem
+    ) -> QgsVectorLayer:
+        return LAYER_CACHE.get(
+            data.original,
+            ("reproject", *self._cache_key(layer, data), crs.toWkt()),
+            lambda: self._run_processing(
                 "native:reprojectlayer",
                 dict(
-                    INPUT=source.data,
-                    TARGET_CRS=QgsCoordinateReferenceSystem("EPSG:3006"),
+                    INPUT=self._materialize(data),
+                    TARGET_CRS=crs,
                     OPERATION=None,
                     OUTPUT="memory:",
                 ),
-            )["OUTPUT"]
+            )["OUTPUT"],
+        )
+
+    def _execute_buffered_layer(self, layer: BufferedLayer) -> VectorData:
+        source = self._execute_layer(layer.source)
+        # buffering the same data again (also in later questions) is served from the cache
+        result = LAYER_CACHE.get(
+            source.original,
+            ("buffer", *self._cache_key(layer.source, source), layer.distance),
+            lambda: self._buffer(layer.source, source, layer.distance),
+        )
+        return VectorData(original=source.original, data=result)
+
+    def _buffer(
+        self, layer: Layer, source: VectorData, distance: float
+    ) -> QgsVectorLayer:
+        crs = self._metric_crs(source.data)
+        if crs != source.data.crs():
+            result = self._reproject(layer, source, crs)
         else:
-            result = source.data
+            result = self._materialize(source)
 
         result = self._run_processing(
             "native:buffer",
             dict(
                 INPUT=result,
                 OUTPUT="memory:",
-                DISTANCE=layer.distance,
+                DISTANCE=distance,
                 SEGMENTS=5,
                 END_CAP_STYLE=0,
                 JOIN_STYLE=0,
@@ -264,7 +828,7 @@ class Executor:
             ),
         )["OUTPUT"]
 
-        if source.data.crs().mapUnits() != QgsUnitTypes.DistanceMeters:
+        if crs != source.data.crs():
             result = self._run_processing(
                 "native:reprojectlayer",
                 dict(
@@ -275,108 +839,226 @@ class Executor:
                 ),
             )["OUTPUT"]
 
-        return VectorData(original=source.original, data=result)
+        return result
 
     def _execute_union_layer(self, layer: UnionLayer) -> VectorData:
-        source_a = self._execute_layer(layer.source_a)
-        source_b = self._execute_layer(layer.source_b)
-        result = self._run_processing(
-            "native:union",
-            dict(
-                INPUT=source_a.data,
-                OVERLAY=source_b.data,
-                OVERLAY_FIELDS_PREFIX="",
-                OUTPUT="memory:",
-            ),
-        )
-        LOGGER.warning(
-            f"Union result contains {result['OUTPUT'].featureCount()} features"
-        )
-        return VectorData(original=source_a.original, data=result["OUTPUT"])
+        # a chain of unions is executed as a single union of all its operands
+        sources = self._execute_layers(*union_operands(layer))
+        inputs = [self._materialize(source) for source in sources]
+        if len(inputs) > 2 and QgsApplication.processingRegistry().algorithmById(
+            "native:multiunion"
+        ):
+            result = self._run_processing(
+                "native:multiunion",
+                dict(
+                    INPUT=inputs[0],
+                    OVERLAYS=inputs[1:],
+                    OVERLAY_FIELDS_PREFIX="",
+                    OUTPUT="memory:",
+                ),
+            )["OUTPUT"]
+        else:
+            # QGIS versions without multiunion
+            result = inputs[0]
+            for overlay in inputs[1:]:
+                result = self._run_processing(
+                    "native:union",
+                    dict(
+                        INPUT=result,
+                        OVERLAY=overlay,
+                        OVERLAY_FIELDS_PREFIX="",
+                        OUTPUT="memory:",
+                    ),
+                )["OUTPUT"]
+
+        # the fields of each overlay come after those of the layers before it, with their
+        # original ids renamed (e.g. to __askgis_fid_2), features only in an overlay would
+        # lose them otherwise
+        other_fields = []
+        offset = inputs[0].fields().count()
+        for source, overlay in zip(sources[1:], inputs[1:]):
+            if source.original is sources[0].original:
+                other_fields.append(
+                    offset + overlay.fields().lookupField(ORIGIN_FID_FIELD)
+                )
+            offset += overlay.fields().count()
+        if other_fields:
+            _coalesce_origin_fids(result, other_fields)
+        LOGGER.warning(f"Union result contains {result.featureCount()} features")
+        return VectorData(original=sources[0].original, data=result)
 
     def _execute_intersection_layer(self, layer: IntersectionLayer) -> VectorData:
-        source_a = self._execute_layer(layer.source_a)
-        source_b = self._execute_layer(layer.source_b)
+        source_a, source_b = self._execute_layers(layer.source_a, layer.source_b)
+        transform_context = self._project.transformContext()
 
-        overlay = self._run_processing(
-            "native:dissolve",
-            dict(
-                INPUT=source_b.data, FIELD=[], SEPARATE_DISJOINT=True, OUTPUT="memory:"
-            ),
-        )
-
-        opts = QgsVectorFileWriter.SaveVectorOptions()
-        opts.driverName = "GeoJSON"
-        QgsVectorFileWriter.writeAsVectorFormatV3(
-            source_a.data,
-            "/mnt/c/Users/jan/Downloads/a.geojson",
-            self._project.transformContext(),
-            opts,
-        )
-        QgsVectorFileWriter.writeAsVectorFormatV3(
-            overlay["OUTPUT"],
-            "/mnt/c/Users/jan/Downloads/b.geojson",
-            self._project.transformContext(),
-            opts,
+        # features can only intersect where both layers have data
+        input_b = self._materialize(
+            source_b,
+            transformed_extent(source_a.data, source_b.data, transform_context),
         )
 
         if (
             source_a.data.geometryType() == QgsWkbTypes.PolygonGeometry
             and source_b.data.geometryType() == QgsWkbTypes.LineGeometry
         ):
-            # special case as intersecting polygon and line never will give a result
-            result = self._run_processing(
-                "native:extractbylocation",
-                dict(
-                    INPUT=source_a.data,
-                    INTERSECT=overlay["OUTPUT"],
-                    PREDICATE=[0],
-                    OUTPUT="memory:",
-                ),
-            )
-        else:
-            result = self._run_processing(
-                "native:intersection",
-                dict(
-                    INPUT=source_a.data,
-                    OVERLAY=overlay["OUTPUT"],
-                    INPUT_FIELDS=[],
-                    OVERLAY_FIELDS=[],
-                    OVERLAY_FIELDS_PREFIX="",
-                    OUTPUT="memory:",
-                ),
+            # special case as intersecting polygon and line never will give a result,
+            # the polygons keep their geometry so just find which ones are intersecting
+            fids = intersecting_ids(
+                source_a.data, source_a.request(), input_b, transform_context
             )
+            LOGGER.warning(f"Intersection resulted in {len(fids)} features")
+            return VectorData(original=source_a.original, data=source_a.data, fids=fids)
+
+        input_a = self._materialize(
+            source_a, transformed_extent(input_b, source_a.data, transform_context)
+        )
+        overlay = self._run_processing(
+            "native:dissolve",
+            dict(INPUT=input_b, FIELD=[], SEPARATE_DISJOINT=True, OUTPUT="memory:"),
+        )
+        result = self._overlay(
+            "native:intersection",
+            input_a,
+            overlay["OUTPUT"],
+            dict(INPUT_FIELDS=[], OVERLAY_FIELDS=[], OVERLAY_FIELDS_PREFIX=""),
+        )
         LOGGER.warning(
-            f"Intersection went from {source_a.data.featureCount()} to {result['OUTPUT'].featureCount()} features"
+            f"Intersection went from {input_a.featureCount()} to {result.featureCount()} features"
         )
-        return VectorData(original=source_a.original, data=result["OUTPUT"])
+        return VectorData(original=source_a.original, data=result)
 
     def _execute_difference_layer(self, layer: DifferenceLayer) -> VectorData:
-        source_a = self._execute_layer(layer.source_a)
-        source_b = self._execute_layer(layer.source_b)
-        result = self._run_processing(
+        source_a, source_b = self._execute_layers(layer.source_a, layer.source_b)
+        result = self._overlay(
             "native:difference",
-            dict(
-                INPUT=source_a.data,
-                OVERLAY=source_b.data,
-                OUTPUT="memory:",
+            self._materialize(source_a),
+            # only overlay features within the extent of the input can have an effect
+            self._materialize(
+                source_b,
+                transformed_extent(
+                    source_a.data, source_b.data, self._project.transformContext()
+                ),
             ),
+            {},
         )
-        return VectorData(original=source_a.original, data=result["OUTPUT"])
+        return VectorData(original=source_a.original, data=result)
+
+    def _overlay(
+        self,
+        algorithm: str,
+        input: QgsVectorLayer,
+        overlay: QgsVectorLayer,
+        parameters: dict,
+    ) -> QgsVectorLayer:
+        """Run an overlay algorithm, for large inputs split in tiles processed in parallel.
+
+        Every input feature is in exactly one tile, together with all overlay features that
+        might intersect it, so the result has the same features as processing it at once.
+        """
+
+        count = input.featureCount()
+        threshold = partition_threshold()
+        if threshold <= 0 or count < threshold:
+            return self._run_processing(
+                algorithm,
+                dict(INPUT=input, OVERLAY=overlay, OUTPUT="memory:", **parameters),
+            )["OUTPUT"]
 
-    def _execute_action(self, action: Action) -> str:
-        return getattr(self, f"_execute_{to_snake_case(action.__class__.__name__)}")(
-            action
+        transform = None
+        if input.crs() != overlay.crs():
+            transform = QgsCoordinateTransform(
+                input.crs(), overlay.crs(), self._project.transformContext()
+            )
+        # the tiles are split off here, so that every layer is only used by one thread
+        tiles = []
+        for fids, extent in grid_partition(
+            input, max(2 * MAX_BRANCHES, count // TILE_FEATURES)
+        ):
+            request = QgsFeatureRequest()
+            request.setFilterFids(fids)
+            overlay_request = QgsFeatureRequest()
+            if extent.isNull():
+                overlay_request.setFilterFids([])
+            else:
+                overlay_request.setFilterRect(
+                    extent
+                    if transform is None
+                    else transform.transformBoundingBox(extent)
+                )
+            tiles.append(
+                dict(
+                    INPUT=input.materialize(request),
+                    OVERLAY=overlay.materialize(overlay_request),
+                    OUTPUT="memory:",
+                    **parameters,
+                )
+            )
+        LOGGER.warning(f"Running {algorithm} on {count} features in {len(tiles)} tiles")
+
+        results = self._parallel(
+            [partial(self._run_processing, algorithm, tile) for tile in tiles]
+        )
+        result = results[0]["OUTPUT"]
+        for other in results[1:]:
+            result.dataProvider().addFeatures(list(other["OUTPUT"].getFeatures()))
+        return result
+
+    def _distance_index(
+        self, layer: Layer, data: VectorData, crs: QgsCoordinateReferenceSystem
+    ) -> PreparedIndex:
+        # the index (with the geometries for nearest queries) only depends on the source,
+        # so it is reused by later questions
+        return LAYER_CACHE.get(
+            data.original,
+            ("distance_index", *self._cache_key(layer, data), crs.toWkt()),
+            lambda: distance_index(
+                data.data, data.request(), crs, self._project.transformContext()
+            ),
         )
 
+    def _execute_within_distance_layer(self, layer: WithinDistanceLayer) -> VectorData:
+        source, target = self._execute_layers(layer.source, layer.target)
+
+        # the target is usually the smaller side, so it is indexed instead of the source
+        crs = self._metric_crs(source.data, target.data)
+        fids = within_distance_ids(
+            source.data,
+            source.request(),
+            target.data,
+            target.request(),
+            layer.distance,
+            crs,
+            self._project.transformContext(),
+        )
+        LOGGER.warning(f"Found {len(fids)} features within {layer.distance}m")
+        return VectorData(original=source.original, data=source.data, fids=fids)
+
+    def _execute_nearest_layer(self, layer: NearestLayer) -> VectorData:
+        source, target = self._execute_layers(layer.source, layer.target)
+
+        crs = self._metric_crs(source.data)
+        index = self._distance_index(layer.source, source, crs)
+        fids = nearest_ids(
+            index,
+            target.data,
+            target.request(),
+            int(layer.k),
+            crs,
+            self._project.transformContext(),
+        )
+        LOGGER.warning(f"Found {len(fids)} nearest features")
+        return VectorData(original=source.original, data=source.data, fids=fids)
+
+    def _execute_action(self, action: Action) -> str:
+        with self._instrument(action):
+            return getattr(
+                self, f"_execute_{to_snake_case(action.__class__.__name__)}"
+            )(action)
+
     def _execute_select_action(self, action: SelectAction) -> str:
         layer = self._execute_layer(action.layer)
         layer.original.selectByIds(
-            [
-                f.attribute(layer.original.primaryKeyAttributes()[0])
-                for f in layer.data.getFeatures()
-            ],
-            QgsVectorLayer.SetSelection,
+            list(self._origin_fids(layer)), QgsVectorLayer.SetSelection
         )
 
         if layer.original.selectedFeatureCount() == 1:
@@ -385,20 +1067,115 @@ class Executor:
 
     def _execute_add_to_map_action(self, action: AddToMapAction) -> str:
         layer = self._execute_layer(action.layer)
-        self._project.addMapLayer(layer.data)
+        data = self._materialize(layer)
+        if data.providerType() == "memory":
+            # memory layers might be shared through the cache, the map gets its own copy
+            data = data.materialize(QgsFeatureRequest())
+        self._project.addMapLayer(data)
 
         return "Added data as a new layer to the map"
 
     def _execute_count_action(self, action: CountAction) -> str:
-        layer = self._execute_layer(action.layer)
+        count = self._count_layer(action.layer)
 
-        if layer.data.featureCount() == 1:
+        if count == 1:
             return "There is 1 matching feature"
         else:
-            return f"There are {layer.data.featureCount()} matching features"
+            return f"There are {count} matching features"
+
+    def _count_layer(self, layer: Layer) -> int:
+        method = getattr(
+            self, f"_count_{to_snake_case(layer.__class__.__name__)}", None
+        )
+        if method is None:
+            return self._count(self._execute_layer(layer))
+
+        with self._instrument(layer) as profile:
+            count = method(layer)
+        if profile is not None:
+            profile.output_features = count
+        return count
+
+    def _count(self, data: VectorData) -> int:
+        """Count the features without materializing them, if possible using the provider."""
+
+        if data.fids is not None and not data.expression:
+            return len(data.fids)
+
+        if not data.expression:
+            count = data.data.featureCount()
+            if count >= 0:
+                return count
+        elif (
+            data.fids is None
+            and data.data.providerType() != "memory"
+            and data.data.dataProvider().supportsSubsetString()
+        ):
+            view = data.data.clone()
+            if view.setSubsetString(
+                _and_expressions(data.data.subsetString(), data.expression)
+            ):
+                count = view.featureCount()
+                if count >= 0:
+                    return count
+
+        request = data.request()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setNoAttributes()
+        return sum(1 for _ in data.data.getFeatures(request))
+
+    def _count_difference_layer(self, layer: DifferenceLayer) -> int:
+        source_a, source_b = self._execute_layers(layer.source_a, layer.source_b)
+        transform_context = self._project.transformContext()
+        return count_difference(
+            source_a.data,
+            source_a.request(),
+            self._materialize(
+                source_b,
+                transformed_extent(source_a.data, source_b.data, transform_context),
+            ),
+            transform_context,
+        )
 
     def _run_processing(self, algorithm: str, parameters: dict) -> dict:
         LOGGER.warning(
             f"Running algorithm {algorithm} with parameters: {repr(parameters)}"
         )
-        return processing.run(algorithm, parameters, feedback=self._feedback)
+        start = time.perf_counter()
+        with (
+            self._tracer.span(algorithm, f"processing:{algorithm}")
+            if self._tracer
+            else nullcontext()
+        ):
+            result = processing.run(algorithm, parameters, feedback=self._feedback)
+        for value in result.values():
+            if isinstance(value, QgsVectorLayer):
+                ensure_spatial_index(value)
+        if self._profiler is not None:
+            self._record_algorithm(algorithm, parameters, result, start)
+        return result
+
+    def _record_algorithm(
+        self, algorithm: str, parameters: dict, result: dict, start: float
+    ) -> None:
+        outputs = [v for v in result.values() if isinstance(v, QgsVectorLayer)]
+        self._profiler.record_algorithm(
+            AlgorithmRun(
+                algorithm,
+                (time.perf_counter() - start) * 1000,
+                [
+                    layer.featureCount()
+                    for name in ("INPUT", "OVERLAY", "OVERLAYS")
+                    for layer in (
+                        parameters[name]
+                        if isinstance(parameters.get(name), list)
+                        else [parameters.get(name)]
+                    )
+                    if isinstance(layer, QgsVectorLayer)
+                ],
+                outputs[0].featureCount() if outputs else None,
+            )
+        )
+        for output in outputs:
+            if output.providerType() == "memory":
+                self._profiler.record_memory_layer(output.featureCount())
@@ -0,0 +1,199 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from threading import RLock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from qgis.core import QgsApplication, QgsProviderRegistry, QgsTask, QgsVectorLayer
+from qgis.PyQt.QtCore import QVariant
+
+from askgis import LOGGER
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+MAX_DISTINCT_VALUES = 50
+"""Fields with more distinct values than this only get summarized as "is a string"."""
+MAX_AGE = 24 * 60 * 60
+"""Summaries of layers without a modification time (e.g. databases) are refreshed after this many seconds."""
+MAX_ENTRIES = 500
+"""The most recent summaries of at most this many layers are stored."""
+
+NUMBER_TYPES = (
+    QVariant.Int,
+    QVariant.UInt,
+    QVariant.LongLong,
+    QVariant.ULongLong,
+    QVariant.Double,
+)
+
+
+@dataclass
+class FieldSummary:
+    values: Optional[List[str]] = None
+    """All distinct values, if there are at most MAX_DISTINCT_VALUES of them."""
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+def layer_path(layer: QgsVectorLayer) -> Optional[str]:
+    """The file containing the data of the layer, if any."""
+
+    parts = QgsProviderRegistry.instance().decodeUri(
+        layer.providerType(), layer.source()
+    )
+    return parts.get("path") or None
+
+
+def layer_fingerprint(layer: QgsVectorLayer) -> str:
+    """Identifies the data of a layer, changes when the file containing the data is modified."""
+
+    path = layer_path(layer)
+    modified = os.path.getmtime(path) if path and os.path.exists(path) else None
+    return f"{layer.providerType()}|{layer.source()}|{modified}"
+
+
+def _prune(entries: Dict[str, dict]) -> Dict[str, dict]:
+    """Only the latest entries of layers that still exist, at most MAX_ENTRIES of them."""
+
+    latest: Dict[str, Tuple[str, dict]] = {}
+    for fingerprint, entry in sorted(
+        entries.items(), key=lambda item: item[1]["created"]
+    ):
+        path = entry.get("path")
+        if path and not os.path.exists(path):
+            continue
+        if (
+            not entry["fingerprint_has_time"]
+            and time.time() - entry["created"] > MAX_AGE
+        ):
+            continue
+        # a later summary of the same layer replaces the earlier ones (older file versions)
+        latest[fingerprint.rsplit("|", 1)[0]] = (fingerprint, entry)
+    return dict(list(latest.values())[-MAX_ENTRIES:])
+
+
+def summarize_fields(layer: QgsVectorLayer) -> Dict[str, FieldSummary]:
+    summaries = {}
+    for idx, field in enumerate(layer.fields().toList()):
+        if field.type() == QVariant.String:
+            values = layer.uniqueValues(idx, MAX_DISTINCT_VALUES + 1)
+            values = [v for v in values if isinstance(v, str)]
+            summaries[field.name()] = FieldSummary(
+                values=sorted(values) if len(values) <= MAX_DISTINCT_VALUES else None
+            )
+        elif field.type() in NUMBER_TYPES:
+            minimum, maximum = layer.minimumValue(idx), layer.maximumValue(idx)
+            if isinstance(minimum, (int, float)) and isinstance(maximum, (int, float)):
+                summaries[field.name()] = FieldSummary(minimum=minimum, maximum=maximum)
+    return summaries
+
+
+class FieldSummaryTask(QgsTask):
+    def __init__(self, layer: QgsVectorLayer, fingerprint: str):
+        super().__init__(f"Summarizing {layer.name()}", QgsTask.CanCancel)
+        self._source = layer.source()
+        self._provider = layer.providerType()
+        self._name = layer.name()
+        self.fingerprint = fingerprint
+        self.path = layer_path(layer)
+        self.summaries: Optional[Dict[str, FieldSummary]] = None
+
+    def run(self) -> bool:
+        # a separate layer instance, as layers must not be shared between threads
+        layer = QgsVectorLayer(self._source, self._name, self._provider)
+        if not layer.isValid():
+            return False
+        self.summaries = summarize_fields(layer)
+        return not self.isCanceled()
+
+
+class FieldSummaryStore:
+    """Summaries of the values of fields, persisted in the profile directory.
+
+    Summaries are computed in the background and keyed on the layer fingerprint, so they
+    are reused across sessions as long as the data does not change. Memory layers are not
+    summarized, as their data can not be read from another thread (nor in later sessions).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._entries: Optional[Dict[str, dict]] = None
+        self._tasks: Dict[str, FieldSummaryTask] = {}
+        self._lock = RLock()
+
+    def _load(self) -> Dict[str, dict]:
+        with self._lock:
+            if self._entries is None:
+                if self._path is None:
+                    self._path = profile_path("field-summaries.json")
+                try:
+                    with open(self._path, encoding="utf-8") as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError):
+                    self._entries = {}
+            return self._entries
+
+    def _save(self) -> None:
+        with self._lock:
+            try:
+                with open(self._path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f)
+            except OSError as e:
+                LOGGER.warning(f"Could not save field summaries: {e}")
+
+    def _entry(self, layer: QgsVectorLayer) -> Optional[dict]:
+        entry = self._load().get(layer_fingerprint(layer))
+        if entry is None or (
+            not entry["fingerprint_has_time"]
+            and time.time() - entry["created"] > MAX_AGE
+        ):
+            return None
+        return entry
+
+    def get(self, layer: QgsVectorLayer) -> Dict[str, FieldSummary]:
+        """The stored summaries of the fields of the layer, empty if there are none yet."""
+
+        entry = self._entry(layer)
+        if entry is None:
+            return {}
+        return {
+            name: FieldSummary(**summary) for name, summary in entry["fields"].items()
+        }
+
+    def ensure(
+        self, layer: QgsVectorLayer, done: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Start summarizing the fields of the layer in the background, unless already stored."""
+
+        if layer.providerType() == "memory" or self._entry(layer) is not None:
+            return
+        fingerprint = layer_fingerprint(layer)
+        if fingerprint in self._tasks:
+            return
+
+        task = FieldSummaryTask(layer, fingerprint)
+        task.taskCompleted.connect(lambda: self._completed(task, done))
+        task.taskTerminated.connect(lambda: self._tasks.pop(fingerprint, None))
+        # keep a reference, otherwise the task might be garbage collected while running
+        self._tasks[fingerprint] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _completed(
+        self, task: FieldSummaryTask, done: Optional[Callable[[], None]]
+    ) -> None:
+        self._tasks.pop(task.fingerprint, None)
+        with self._lock:
+            entries = self._load()
+            entries[task.fingerprint] = dict(
+                created=time.time(),
+                fingerprint_has_time=not task.fingerprint.endswith("|None"),
+                path=task.path,
+                fields={name: asdict(s) for name, s in task.summaries.items()},
+            )
+            self._entries = _prune(entries)
+            self._save()
+        if done is not None:
+            done()
+
+
+FIELD_SUMMARIES = FieldSummaryStore()
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from functools import partial
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from qgis.core import QgsVectorLayer
+from qgis.PyQt import sip
+from qgis.PyQt.QtCore import QObject
+
+from askgis.lib.util import CacheStats
+
+
+class LayerCache:
+    """A bounded cache of values derived from layers, lasting for the whole session.
+
+    Entries are keyed on the layer, its modification state and a caller-given key. The
+    modification state is a revision counter that is increased whenever the layer changes,
+    at which point all entries for the previous revisions are dropped.
+
+    Only layers of the project should be used, other (e.g. intermediate memory) layers would
+    be kept alive by their entries without ever being looked up again.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Any]" = OrderedDict()
+        self._revisions: Dict[str, int] = {}
+        self._lock = RLock()
+        self.stats = CacheStats()
+
+    def revision(self, layer: QgsVectorLayer) -> int:
+        """The modification state of the layer, increases whenever its data changes."""
+
+        with self._lock:
+            if layer.id() not in self._revisions:
+                self._revisions[layer.id()] = 0
+                layer.dataChanged.connect(partial(self._changed, layer.id()))
+                layer.layerModified.connect(partial(self._changed, layer.id()))
+                layer.willBeDeleted.connect(partial(self._forget, layer.id()))
+            return self._revisions[layer.id()]
+
+    def get(
+        self,
+        layer: QgsVectorLayer,
+        key: Tuple[Hashable, ...],
+        factory: Callable[[], Any],
+    ) -> Any:
+        """Get the cached value for the layer and key, or create (and cache) it using factory."""
+
+        full_key = (layer.id(), self.revision(layer), *key)
+        with self._lock:
+            value = self._entries.get(full_key)
+            if value is not None and not (
+                isinstance(value, QObject) and sip.isdeleted(value)
+            ):
+                self._entries.move_to_end(full_key)
+                self.stats.hits += 1
+                return value
+            self.stats.misses += 1
+
+        value = factory()
+        with self._lock:
+            self._entries[full_key] = value
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _changed(self, layer_id: str, *_args: Any) -> None:
+        with self._lock:
+            self._revisions[layer_id] += 1
+            self._drop(layer_id)
+
+    def _forget(self, layer_id: str, *_args: Any) -> None:
+        with self._lock:
+            self._revisions.pop(layer_id, None)
+            self._drop(layer_id)
+
+    def _drop(self, layer_id: str) -> None:
+        for key in [k for k in self._entries if k[0] == layer_id]:
+            del self._entries[key]
+
+
+LAYER_CACHE = LayerCache()
+"""Session cache for reprojected and buffered layers and distance indexes."""
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+
+import langchain
+from langchain.cache import BaseCache
+from langchain.schema import Generation
+
+from askgis import LOGGER
+from askgis.lib.util import CacheStats
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    prompt TEXT NOT NULL,
+    llm TEXT NOT NULL,
+    generations TEXT NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (prompt, llm)
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+
+class BoundedSQLiteCache(BaseCache):
+    """An LLM response cache in SQLite that can be used from several threads.
+
+    The database is only opened on first use, each thread gets its own connection and the
+    database is in WAL mode so that readers do not block. Entries older than max_age
+    seconds and the least recently used entries beyond max_entries are evicted, and the file
+    is compacted, every compact_interval updates. That happens in a separate thread, so that
+    it does not hold up the question being answered.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 5000,
+        max_age: float = 30 * 24 * 60 * 60,
+        compact_interval: int = 100,
+    ):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._compact_interval = compact_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._updates = 0
+        self._compacting = False
+        self.stats = CacheStats()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._path, timeout=10)
+        db.execute("PRAGMA busy_timeout = 10000")
+        # needs to be set before the tables are created to have any effect
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        with db:
+            db.executescript(_SCHEMA)
+        return db
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[List[Generation]]:
+        db = self._db()
+        key = self._key(prompt)
+        row = db.execute(
+            "SELECT generations FROM responses"
+            " WHERE prompt = ? AND llm = ? AND created > ?",
+            (key, llm_string, time.time() - self._max_age),
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+        with db:
+            db.execute(
+                "UPDATE responses SET used = ? WHERE prompt = ? AND llm = ?",
+                (time.time(), key, llm_string),
+            )
+        return [Generation(**generation) for generation in json.loads(row[0])]
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: List[Generation]
+    ) -> None:
+        generations = json.dumps(
+            [dict(text=g.text, generation_info=g.generation_info) for g in return_val]
+        )
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (prompt, llm, generations, created, used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self._key(prompt), llm_string, generations, now, now),
+            )
+
+        with self._lock:
+            self._updates += 1
+            compact = self._updates % self._compact_interval == 0
+        if compact:
+            self.compact_in_background()
+
+    def compact_in_background(self) -> None:
+        """Compact in a separate thread, unless that is already being done."""
+
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(
+            target=self._compact_in_thread, name="llm-cache-compact", daemon=True
+        ).start()
+
+    def _compact_in_thread(self) -> None:
+        try:
+            db = self._connect()
+            try:
+                self.compact(db)
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            LOGGER.warning(f"Could not compact the LLM cache: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self, db: Optional[sqlite3.Connection] = None) -> None:
+        """Evict old and superfluous entries and give the space back to the file system."""
+
+        db = db or self._db()
+        with db:
+            expired = db.execute(
+                "DELETE FROM responses WHERE created <= ?",
+                (time.time() - self._max_age,),
+            ).rowcount
+            evicted = db.execute(
+                "DELETE FROM responses WHERE rowid NOT IN"
+                " (SELECT rowid FROM responses ORDER BY used DESC LIMIT ?)",
+                (self._max_entries,),
+            ).rowcount
+        db.execute("PRAGMA incremental_vacuum")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        LOGGER.info(f"LLM cache compacted, {expired} expired and {evicted} evicted")
+
+    def clear(self, **kwargs: Any) -> None:
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM responses")
+        db.execute("PRAGMA incremental_vacuum")
+
+    def log_stats(self) -> None:
+        LOGGER.info(
+            f"LLM cache: {self.stats.hits} hits, {self.stats.misses} misses ({self.stats.hit_rate:.0%} hit rate)"
+        )
+
+
+_install_lock = threading.Lock()
+
+
+def _remove_old_cache() -> None:
+    """Remove the unbounded cache of earlier versions, its entries are not worth migrating."""
+
+    path = profile_path("langchain-cache.db")
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+            LOGGER.info(f"Removed the old LLM cache {path}")
+        except OSError as e:
+            LOGGER.warning(f"Could not remove the old LLM cache {path}: {e}")
+
+
+def install_llm_cache() -> None:
+    """Make langchain use our cache, done on the first question instead of at startup."""
+
+    with _install_lock:
+        if not isinstance(langchain.llm_cache, BoundedSQLiteCache):
+            _remove_old_cache()
+            cache = BoundedSQLiteCache(profile_path("llm-cache.sqlite"))
+            # entries might have expired since the previous session
+            cache.compact_in_background()
+            langchain.llm_cache = cache
+
+
+def log_cache_stats() -> None:
+    """Log the hit rate of the LLM cache, if it is ours."""
+
+    if isinstance(langchain.llm_cache, BoundedSQLiteCache):
+        langchain.llm_cache.log_stats()
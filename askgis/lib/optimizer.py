@@ -0,0 +1,229 @@
+from dataclasses import fields
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+from qgis.core import QgsProject, QgsVectorLayer
+
+from askgis import LOGGER
+from askgis.lib.executor import (
+    Action,
+    BinaryOperationLayer,
+    BufferedLayer,
+    CountAction,
+    FilteredLayer,
+    IntersectionLayer,
+    Layer,
+    MultiValueFilteredLayer,
+    SelectAction,
+    SourceLayer,
+    UnionLayer,
+    WithinDistanceLayer,
+    find_layer,
+    rebuild,
+    to_code,
+    union_operands,
+)
+
+Rule = Callable[[Layer], Optional[Layer]]
+"""A rule gets a layer and returns an equivalent, cheaper, layer or None if it does not apply."""
+ActionRule = Callable[[Action, Optional[QgsProject]], Optional[Action]]
+"""Like Rule, but gets the entire action, for rewrites that depend on how the result is used.
+
+Also gets the project the plan is for, if known, for rewrites that depend on the data.
+"""
+
+
+def _make_union(operands: List[Layer]) -> Layer:
+    return operands[0] if len(operands) == 1 else UnionLayer(*operands)
+
+
+def dedupe_unions(layer: Layer) -> Optional[Layer]:
+    """union(L, union(M, L)) -> union(L, M), every layer is only needed once in a union.
+
+    The executor runs the remaining chain of unions as a single union of all its operands.
+    """
+
+    if not isinstance(layer, UnionLayer):
+        return None
+
+    unique: Dict[Hashable, Layer] = {}
+    for operand in union_operands(layer):
+        unique.setdefault(operand.key(), operand)
+    result = _make_union(list(unique.values()))
+    return None if result.key() == layer.key() else result
+
+
+def _filter_values(layer: Union[FilteredLayer, MultiValueFilteredLayer]) -> tuple:
+    if isinstance(layer, MultiValueFilteredLayer):
+        return layer.values
+    return (layer.value,)
+
+
+def merge_union_filters(layer: Layer) -> Optional[Layer]:
+    """union(filter(L, f, a), filter(L, f, b)) -> filter(L, f, [a, b])"""
+
+    if not isinstance(layer, UnionLayer):
+        return None
+
+    groups: Dict[Hashable, List[Union[FilteredLayer, MultiValueFilteredLayer]]] = {}
+    operands: List[Union[Layer, Hashable]] = []
+    for operand in union_operands(layer):
+        if isinstance(operand, (FilteredLayer, MultiValueFilteredLayer)):
+            group = (operand.source.key(), operand.field)
+            if group not in groups:
+                operands.append(group)
+            groups.setdefault(group, []).append(operand)
+        else:
+            operands.append(operand)
+
+    if all(len(filters) == 1 for filters in groups.values()):
+        return None
+
+    def merge(filters: List[Union[FilteredLayer, MultiValueFilteredLayer]]) -> Layer:
+        if len(filters) == 1:
+            return filters[0]
+        values = []
+        for f in filters:
+            for value in _filter_values(f):
+                if value not in values:
+                    values.append(value)
+        return MultiValueFilteredLayer(
+            filters[0].source, filters[0].field, tuple(values)
+        )
+
+    return _make_union(
+        [
+            operand if isinstance(operand, Layer) else merge(groups[operand])
+            for operand in operands
+        ]
+    )
+
+
+def push_filter_below_buffer(layer: Layer) -> Optional[Layer]:
+    """filter(buffer(L, d), f, v) -> buffer(filter(L, f, v), d), buffering keeps the attributes."""
+
+    if isinstance(layer, (FilteredLayer, MultiValueFilteredLayer)) and isinstance(
+        layer.source, BufferedLayer
+    ):
+        return rebuild(layer.source, source=rebuild(layer, source=layer.source.source))
+    return None
+
+
+def _source_layer(
+    layer: Layer, project: Optional[QgsProject]
+) -> Optional[QgsVectorLayer]:
+    """The layer of the project that the features of layer are derived from."""
+
+    if project is None:
+        return None
+    while not isinstance(layer, SourceLayer):
+        layer = (
+            layer.source_a if isinstance(layer, BinaryOperationLayer) else layer.source
+        )
+    try:
+        original = find_layer(project, layer.id)
+    except FileNotFoundError:
+        return None
+    return original if isinstance(original, QgsVectorLayer) else None
+
+
+def _buffer_intersection_to_within_distance(
+    layer: Layer, project: Optional[QgsProject], filtered: Tuple[str, ...] = ()
+) -> Optional[Layer]:
+    if isinstance(layer, (FilteredLayer, MultiValueFilteredLayer)):
+        source = _buffer_intersection_to_within_distance(
+            layer.source, project, (*filtered, layer.field)
+        )
+        return None if source is None else rebuild(layer, source=source)
+    if isinstance(layer, IntersectionLayer) and isinstance(
+        layer.source_b, BufferedLayer
+    ):
+        if filtered:
+            # the intersection also has the fields of B, within_distance only those of A
+            original = _source_layer(layer.source_a, project)
+            if original is None or any(
+                original.fields().lookupField(field) < 0 for field in filtered
+            ):
+                return None
+        return WithinDistanceLayer(
+            layer.source_a, layer.source_b.source, layer.source_b.distance
+        )
+    return None
+
+
+def buffer_intersection_to_within_distance(
+    action: Action, project: Optional[QgsProject]
+) -> Optional[Action]:
+    """select(intersection(A, buffer(B, d))) -> select(within_distance(A, B, d))
+
+    The intersection clips the geometries of A, which only is irrelevant if the result is
+    used to select or count features, so this is only done for the outermost layer (and
+    filters on top of it, as long as they only use fields of A).
+    """
+
+    if not isinstance(action, (SelectAction, CountAction)):
+        return None
+    layer = _buffer_intersection_to_within_distance(action.layer, project)
+    return None if layer is None else rebuild(action, layer=layer)
+
+
+DEFAULT_RULES: List[Rule] = [
+    dedupe_unions,
+    merge_union_filters,
+    push_filter_below_buffer,
+]
+DEFAULT_ACTION_RULES: List[ActionRule] = [
+    buffer_intersection_to_within_distance,
+]
+
+
+class Optimizer:
+    """Rewrites the layer tree of an action using rules until none of them applies anymore."""
+
+    def __init__(
+        self,
+        rules: Optional[Sequence[Rule]] = None,
+        action_rules: Optional[Sequence[ActionRule]] = None,
+        max_rewrites: int = 100,
+    ):
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.action_rules = list(
+            DEFAULT_ACTION_RULES if action_rules is None else action_rules
+        )
+        self._max_rewrites = max_rewrites
+        self._rewrites = 0
+
+    def optimize(
+        self, action: Optional[Action], project: Optional[QgsProject] = None
+    ) -> Optional[Action]:
+        if action is None:
+            return None
+
+        self._rewrites = 0
+        optimized = rebuild(action, layer=self._optimize_layer(action.layer))
+        for rule in self.action_rules:
+            optimized = rule(optimized, project) or optimized
+        LOGGER.info(f"Plan before optimization: {to_code(action)}")
+        LOGGER.info(f"Plan after optimization: {to_code(optimized)}")
+        return optimized
+
+    def _optimize_layer(self, layer: Layer) -> Layer:
+        layer = rebuild(
+            layer,
+            **{
+                f.name: self._optimize_layer(getattr(layer, f.name))
+                for f in fields(layer)
+                if isinstance(getattr(layer, f.name), Layer)
+            },
+        )
+
+        for rule in self.rules:
+            if self._rewrites >= self._max_rewrites:
+                LOGGER.warning("Reached the maximum number of plan rewrites")
+                break
+            result = rule(layer)
+            if result is not None:
+                self._rewrites += 1
+                # the rewritten layer might now match other rules, also in its children
+                return self._optimize_layer(result)
+
+        return layer
@@ -0,0 +1,320 @@
+import math
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSource,
+    QgsGeometry,
+    QgsGeometryEngine,
+    QgsRectangle,
+    QgsSpatialIndex,
+    QgsVectorDataProvider,
+    QgsVectorLayer,
+)
+
+
+def ensure_spatial_index(layer: QgsVectorLayer) -> None:
+    """Create a spatial index for intermediate (memory) layers that do not have one yet."""
+
+    provider = layer.dataProvider()
+    if (
+        layer.providerType() == "memory"
+        and provider.hasSpatialIndex() == QgsFeatureSource.SpatialIndexNotPresent
+        and provider.capabilities() & QgsVectorDataProvider.CreateSpatialIndex
+    ):
+        provider.createSpatialIndex()
+
+
+def transformed_extent(
+    layer: QgsVectorLayer,
+    target: QgsVectorLayer,
+    transform_context: QgsCoordinateTransformContext,
+) -> QgsRectangle:
+    """The extent of layer in the CRS of target."""
+
+    if layer.crs() == target.crs():
+        return layer.extent()
+    return QgsCoordinateTransform(
+        layer.crs(), target.crs(), transform_context
+    ).transformBoundingBox(layer.extent())
+
+
+class PreparedIndex:
+    """A spatial index over the geometries of a layer, with lazily prepared GEOS geometries.
+
+    With store_geometries the geometries are kept by the spatial index, which then also
+    supports nearest neighbour queries using the actual geometries.
+    """
+
+    def __init__(
+        self,
+        layer: QgsVectorLayer,
+        request: QgsFeatureRequest,
+        transform: Optional[QgsCoordinateTransform] = None,
+        store_geometries: bool = False,
+    ):
+        self._index = QgsSpatialIndex(
+            QgsSpatialIndex.FlagStoreFeatureGeometries
+            if store_geometries
+            else QgsSpatialIndex.Flags()
+        )
+        self._store_geometries = store_geometries
+        self._geometries: Dict[int, QgsGeometry] = {}
+        self._count = 0
+        self._engines: Dict[int, QgsGeometryEngine] = {}
+        self._extent = QgsRectangle()
+        for feature in layer.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isNull() or geometry.isEmpty():
+                continue
+            if transform is not None:
+                geometry.transform(transform)
+            if store_geometries:
+                feature.setGeometry(geometry)
+                self._index.addFeature(feature)
+            else:
+                self._geometries[feature.id()] = geometry
+                self._index.addFeature(feature.id(), geometry.boundingBox())
+            self._count += 1
+            self._extent.combineExtentWith(geometry.boundingBox())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def extent(self) -> QgsRectangle:
+        return QgsRectangle(self._extent)
+
+    def candidates(self, rect: QgsRectangle):
+        return self._index.intersects(rect)
+
+    def geometry(self, fid: int) -> QgsGeometry:
+        if self._store_geometries:
+            return self._index.geometry(fid)
+        return self._geometries[fid]
+
+    def engine(self, fid: int) -> QgsGeometryEngine:
+        if fid not in self._engines:
+            # the engine does not own the geometry, so it has to be kept alive
+            geometry = self._geometries.setdefault(fid, self.geometry(fid))
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            self._engines[fid] = engine
+        return self._engines[fid]
+
+    def intersects(self, geometry: QgsGeometry) -> bool:
+        return any(
+            self.engine(fid).intersects(geometry.constGet())
+            for fid in self.candidates(geometry.boundingBox())
+        )
+
+    def within_distance(self, geometry: QgsGeometry, distance: float) -> bool:
+        return any(
+            self.engine(fid).distance(geometry.constGet()) <= distance
+            for fid in self.candidates(geometry.boundingBox().buffered(distance))
+        )
+
+    def nearest(self, geometry: QgsGeometry, k: int) -> List[int]:
+        """Ids of the k nearest geometries, more if several are at the same distance."""
+
+        return self._index.nearestNeighbor(geometry, k)
+
+
+def grid_partition(
+    layer: QgsVectorLayer, cells: int
+) -> List[Tuple[List[int], QgsRectangle]]:
+    """Split the features of layer over a grid of about the given number of cells.
+
+    Every feature goes to the one cell containing the centre of its bounding box (features
+    without geometry go to the first cell). Returns the feature ids of each non-empty cell
+    with their combined extent, which can reach beyond the cell itself.
+    """
+
+    extent = layer.extent()
+    side = max(1, math.ceil(math.sqrt(cells)))
+    width = extent.width() / side or 1
+    height = extent.height() / side or 1
+
+    ids: Dict[Tuple[int, int], List[int]] = {}
+    extents: Dict[Tuple[int, int], QgsRectangle] = {}
+    request = QgsFeatureRequest()
+    request.setNoAttributes()
+    for feature in layer.getFeatures(request):
+        if not feature.hasGeometry():
+            ids.setdefault((0, 0), []).append(feature.id())
+            continue
+        bbox = feature.geometry().boundingBox()
+        centre = bbox.center()
+        cell = (
+            min(side - 1, max(0, int((centre.x() - extent.xMinimum()) / width))),
+            min(side - 1, max(0, int((centre.y() - extent.yMinimum()) / height))),
+        )
+        ids.setdefault(cell, []).append(feature.id())
+        extents.setdefault(cell, QgsRectangle()).combineExtentWith(bbox)
+    return [(fids, extents.get(cell, QgsRectangle())) for cell, fids in ids.items()]
+
+
+def _transform(
+    source: QgsCoordinateReferenceSystem,
+    destination: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> Optional[QgsCoordinateTransform]:
+    if source == destination:
+        return None
+    return QgsCoordinateTransform(source, destination, transform_context)
+
+
+def intersecting_ids(
+    layer: QgsVectorLayer,
+    request: QgsFeatureRequest,
+    overlay: QgsVectorLayer,
+    transform_context: QgsCoordinateTransformContext,
+) -> Set[int]:
+    """Ids of the features of layer (matching request) that intersect any feature of overlay.
+
+    The overlay is indexed and its geometries are prepared, while the features of layer are
+    only fetched within the extent of the overlay.
+    """
+
+    index = PreparedIndex(
+        overlay,
+        QgsFeatureRequest(),
+        _transform(overlay.crs(), layer.crs(), transform_context),
+    )
+    if len(index) == 0:
+        return set()
+
+    request = QgsFeatureRequest(request)
+    request.setFilterRect(transformed_extent(overlay, layer, transform_context))
+    request.setNoAttributes()
+    return {
+        feature.id()
+        for feature in layer.getFeatures(request)
+        if feature.hasGeometry() and index.intersects(feature.geometry())
+    }
+
+
+def count_difference(
+    layer: QgsVectorLayer,
+    request: QgsFeatureRequest,
+    overlay: QgsVectorLayer,
+    transform_context: QgsCoordinateTransformContext,
+) -> int:
+    """Number of features of layer (matching request) not entirely covered by overlay.
+
+    Counts in a single streaming pass, features that do not touch the overlay are not clipped.
+    Like native:difference, features without geometry are kept.
+    """
+
+    index = PreparedIndex(
+        overlay,
+        QgsFeatureRequest(),
+        _transform(overlay.crs(), layer.crs(), transform_context),
+    )
+    request = QgsFeatureRequest(request)
+    request.setNoAttributes()
+
+    count = 0
+    for feature in layer.getFeatures(request):
+        if not feature.hasGeometry():
+            count += 1
+            continue
+        geometry = feature.geometry()
+        for fid in index.candidates(geometry.boundingBox()):
+            if index.engine(fid).intersects(geometry.constGet()):
+                geometry = geometry.difference(index.geometry(fid))
+                if geometry.isEmpty():
+                    break
+        if not geometry.isEmpty():
+            count += 1
+    return count
+
+
+def _features(
+    layer: QgsVectorLayer,
+    request: QgsFeatureRequest,
+    crs: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> Iterator[Tuple[QgsFeature, QgsGeometry]]:
+    """The features of layer with a geometry, together with that geometry in crs."""
+
+    transform = _transform(layer.crs(), crs, transform_context)
+    request = QgsFeatureRequest(request)
+    request.setNoAttributes()
+    for feature in layer.getFeatures(request):
+        if not feature.hasGeometry():
+            continue
+        geometry = feature.geometry()
+        if transform is not None:
+            geometry.transform(transform)
+        yield feature, geometry
+
+
+def distance_index(
+    layer: QgsVectorLayer,
+    request: QgsFeatureRequest,
+    crs: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> PreparedIndex:
+    """An index over the features of layer (matching request) for nearest queries in crs."""
+
+    return PreparedIndex(
+        layer,
+        request,
+        _transform(layer.crs(), crs, transform_context),
+        store_geometries=True,
+    )
+
+
+def within_distance_ids(
+    layer: QgsVectorLayer,
+    request: QgsFeatureRequest,
+    target: QgsVectorLayer,
+    target_request: QgsFeatureRequest,
+    distance: float,
+    crs: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> Set[int]:
+    """Ids of the features of layer (matching request) within distance of any target feature.
+
+    The distance is given in the units of crs. No buffer polygons are built, instead the
+    target is indexed and only the features of layer near its extent are checked.
+    """
+
+    index = PreparedIndex(
+        target, target_request, _transform(target.crs(), crs, transform_context)
+    )
+    if len(index) == 0:
+        return set()
+
+    search_area = index.extent().buffered(distance)
+    if crs != layer.crs():
+        search_area = QgsCoordinateTransform(
+            crs, layer.crs(), transform_context
+        ).transformBoundingBox(search_area)
+    request = QgsFeatureRequest(request)
+    request.setFilterRect(search_area)
+    return {
+        feature.id()
+        for feature, geometry in _features(layer, request, crs, transform_context)
+        if index.within_distance(geometry, distance)
+    }
+
+
+def nearest_ids(
+    index: PreparedIndex,
+    target: QgsVectorLayer,
+    target_request: QgsFeatureRequest,
+    k: int,
+    crs: QgsCoordinateReferenceSystem,
+    transform_context: QgsCoordinateTransformContext,
+) -> Set[int]:
+    """Ids of the k indexed features nearest to each target feature, crs being that of the index."""
+
+    result = set()
+    for _, geometry in _features(target, target_request, crs, transform_context):
+        result.update(index.nearest(geometry, k))
+    return result
@@ -0,0 +1,159 @@
+import ast
+import re
+from dataclasses import fields
+from typing import Any, Dict, List, Optional, Union, get_args, get_origin
+
+from askgis.lib.executor import Action, Layer, UnionLayer, action_functions, functions
+
+_CODE_FENCE_RE = re.compile(r"^\s*```[a-z]*\s*$", re.MULTILINE)
+
+
+class ParseError(ValueError):
+    """Raised when generated code is not a valid action."""
+
+    def __init__(self, message: str, node: Optional[ast.AST] = None):
+        if node is not None and hasattr(node, "lineno"):
+            message = f"line {node.lineno}, column {node.col_offset + 1}: {message}"
+        super().__init__(message)
+
+
+def _type_name(type) -> str:
+    if get_origin(type) is Union:
+        return " or ".join(_type_name(t) for t in get_args(type))
+    return type.__name__
+
+
+def _check_type(value: Any, expected, node: ast.AST) -> Any:
+    """Check that value matches the type of a field, returns the (possibly converted) value."""
+
+    options = get_args(expected) if get_origin(expected) is Union else (expected,)
+    # bool is a subclass of int, but True is not a valid distance
+    if any(
+        isinstance(value, option) and (option is bool or not isinstance(value, bool))
+        for option in options
+    ):
+        return value
+    if not isinstance(value, bool):
+        if float in options and isinstance(value, int):
+            return float(value)
+        if int in options and isinstance(value, float) and value.is_integer():
+            return int(value)
+    raise ParseError(
+        f"expected {_type_name(expected)}, got {value.__class__.__name__}", node
+    )
+
+
+class _Interpreter:
+    """Evaluates the small subset of Python used for actions, without executing any code."""
+
+    def __init__(self):
+        self.variables: Dict[str, Any] = {}
+        self.actions: List[Action] = []
+
+    def statement(self, node: ast.stmt) -> None:
+        if isinstance(node, (ast.Expr, ast.Return)):
+            if node.value is not None:
+                value = self.expression(node.value)
+                if isinstance(value, Action):
+                    self.actions.append(value)
+        elif isinstance(node, ast.Assign):
+            if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                raise ParseError(
+                    "only assignments to a single name are supported", node
+                )
+            self.variables[node.targets[0].id] = self.expression(node.value)
+        elif isinstance(node, ast.Pass):
+            pass
+        else:
+            raise ParseError(f"unsupported statement {node.__class__.__name__}", node)
+
+    def expression(self, node: ast.expr) -> Any:
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (str, int, float, bool)):
+                raise ParseError(f"unsupported value {node.value!r}", node)
+            return node.value
+        if (
+            isinstance(node, ast.UnaryOp)
+            and isinstance(node.op, (ast.USub, ast.UAdd))
+            and isinstance(node.operand, ast.Constant)
+            and isinstance(node.operand.value, (int, float))
+        ):
+            value = node.operand.value
+            return -value if isinstance(node.op, ast.USub) else value
+        if isinstance(node, ast.Name):
+            if node.id not in self.variables:
+                raise ParseError(f"unknown name {node.id}", node)
+            return self.variables[node.id]
+        if isinstance(node, ast.Call):
+            return self.call(node)
+        raise ParseError(f"unsupported expression {node.__class__.__name__}", node)
+
+    def call(self, node: ast.Call) -> Union[Layer, Action]:
+        if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+            raise ParseError(
+                f"unknown function {ast.unparse(node.func)}, must be one of {', '.join(functions.keys())}",
+                node,
+            )
+        name = node.func.id
+        function = functions[name]
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or any(
+            keyword.arg is None for keyword in node.keywords
+        ):
+            raise ParseError(f"unpacking arguments to {name} is not supported", node)
+        args = [(arg, self.expression(arg)) for arg in node.args]
+        kwargs = {
+            keyword.arg: (keyword.value, self.expression(keyword.value))
+            for keyword in node.keywords
+        }
+
+        if function is UnionLayer:
+            # union takes any number of layers instead of its fields
+            if kwargs or len(args) < 2:
+                raise ParseError(f"{name} takes two or more layers", node)
+            return UnionLayer(*(_check_type(v, Layer, arg) for arg, v in args))
+
+        function_fields = fields(function)
+        if len(args) > len(function_fields):
+            raise ParseError(
+                f"{name} takes {len(function_fields)} arguments, got {len(args)}", node
+            )
+        values = {}
+        for field, (arg, value) in zip(function_fields, args):
+            values[field.name] = _check_type(value, field.type, arg)
+        for key, (arg, value) in kwargs.items():
+            field = next((f for f in function_fields if f.name == key), None)
+            if field is None:
+                raise ParseError(f"{name} has no argument {key}", arg)
+            if key in values:
+                raise ParseError(f"{name} got multiple values for {key}", arg)
+            values[key] = _check_type(value, field.type, arg)
+        missing = [f.name for f in function_fields if f.name not in values]
+        if missing:
+            raise ParseError(f"{name} is missing {', '.join(missing)}", node)
+        return function(**values)
+
+
+def to_action(python: str) -> Action:
+    """Parse the generated Python code into an action and its layer "tree".
+
+    Only calls of the functions in `functions`, literals and assignments are supported, the
+    code is never executed.
+    """
+
+    # there are no blocks in the DSL, so indentation (e.g. from the function body) is irrelevant
+    code = "\n".join(
+        line.strip() for line in _CODE_FENCE_RE.sub("", python).splitlines()
+    ).strip()
+    try:
+        module = ast.parse(code)
+    except SyntaxError as e:
+        raise ParseError(f"line {e.lineno}: {e.msg}") from e
+
+    interpreter = _Interpreter()
+    for statement in module.body:
+        interpreter.statement(statement)
+    if not interpreter.actions:
+        raise ParseError(
+            f"no action, the code must call one of {', '.join(action_functions.keys())}"
+        )
+    return interpreter.actions[0]
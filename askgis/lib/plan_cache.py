@@ -0,0 +1,138 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import fields
+from typing import Iterator, Optional, Set, Tuple, Union
+
+from qgis.core import QgsProject
+
+from askgis import LOGGER
+from askgis.lib.executor import (
+    Action,
+    FilteredLayer,
+    Layer,
+    MultiValueFilteredLayer,
+    SourceLayer,
+    find_layer,
+    to_code,
+)
+from askgis.lib.parser import ParseError, to_action
+from askgis.lib.value_index import normalize
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+MAX_ENTRIES = 1000
+"""The least recently used plans are dropped when there are more than this."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    question TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    code TEXT NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (question, fingerprint)
+)
+"""
+
+
+def _nodes(node: Union[Layer, Action]) -> Iterator[Union[Layer, Action]]:
+    yield node
+    for f in fields(node):
+        value = getattr(node, f.name)
+        if isinstance(value, (Layer, Action)):
+            yield from _nodes(value)
+
+
+def plan_fingerprint(action: Action, project: QgsProject) -> Optional[str]:
+    """Identifies the layers and fields the plan uses, None if any of them is missing."""
+
+    layer_ids: Set[str] = set()
+    field_names: Set[str] = set()
+    for node in _nodes(action):
+        if isinstance(node, SourceLayer):
+            layer_ids.add(node.id)
+        elif isinstance(node, (FilteredLayer, MultiValueFilteredLayer)):
+            field_names.add(node.field)
+
+    parts = []
+    for layer_id in sorted(layer_ids):
+        try:
+            layer = find_layer(project, layer_id)
+        except FileNotFoundError:
+            return None
+        parts.append(
+            [
+                layer_id,
+                layer.name(),
+                layer.providerType(),
+                layer.source(),
+                # fields are used on derived layers too, so not necessarily on this layer
+                {
+                    name: int(layer.fields().field(idx).type())
+                    for name in sorted(field_names)
+                    for idx in [layer.fields().lookupField(name)]
+                    if idx >= 0
+                },
+            ]
+        )
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Maps questions to the plans generated for them, stored in the profile directory.
+
+    Questions are normalized, and a plan is only reused as long as the layers and fields
+    it references did not change, no matter what happens to the rest of the project.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._path is None:
+            self._path = profile_path("plan-cache.sqlite")
+        db = sqlite3.connect(self._path)
+        db.execute(_SCHEMA)
+        return db
+
+    def get(self, question: str, project: QgsProject) -> Optional[Tuple[str, Action]]:
+        """The code and action of a cached plan for the question, if any is still valid."""
+
+        with closing(self._connect()) as db, db:
+            rows = db.execute(
+                "SELECT fingerprint, code FROM plans WHERE question = ? ORDER BY used DESC",
+                (normalize(question),),
+            ).fetchall()
+            for fingerprint, code in rows:
+                try:
+                    action = to_action(code)
+                except ParseError:
+                    continue
+                if plan_fingerprint(action, project) == fingerprint:
+                    db.execute(
+                        "UPDATE plans SET used = ? WHERE question = ? AND fingerprint = ?",
+                        (time.time(), normalize(question), fingerprint),
+                    )
+                    LOGGER.info(f"Using cached plan for {question!r}: {code}")
+                    return code, action
+        return None
+
+    def put(self, question: str, action: Action, project: QgsProject) -> None:
+        fingerprint = plan_fingerprint(action, project)
+        if fingerprint is None:
+            return
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO plans (question, fingerprint, code, used)"
+                " VALUES (?, ?, ?, ?)",
+                (normalize(question), fingerprint, to_code(action), time.time()),
+            )
+            db.execute(
+                "DELETE FROM plans WHERE rowid NOT IN"
+                " (SELECT rowid FROM plans ORDER BY used DESC LIMIT ?)",
+                (MAX_ENTRIES,),
+            )
+
+
+PLAN_CACHE = PlanCache()
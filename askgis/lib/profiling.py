@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Iterator, List, Optional
+
+from qgis.core import QgsSettings
+
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+MAX_LOG_SIZE = 10 * 1024 * 1024
+"""The profile log is rotated once it is larger than this (in bytes)."""
+
+
+def profiling_enabled() -> bool:
+    return QgsSettings().value("/AskGIS/profilePlans", False, type=bool)
+
+
+def _features(count: Optional[int]) -> str:
+    return "?" if count is None else str(count)
+
+
+@dataclass
+class AlgorithmRun:
+    algorithm: str
+    milliseconds: float
+    input_features: List[Optional[int]]
+    output_features: Optional[int]
+
+    def render(self) -> str:
+        inputs = " + ".join(_features(c) for c in self.input_features)
+        return f"{self.algorithm}  {self.milliseconds:.1f} ms, {inputs} -> {_features(self.output_features)} features"
+
+
+@dataclass
+class ProfileNode:
+    """The measurements for one layer or action of an executed plan.
+
+    Counts are None where they are not known without doing extra work, e.g. for filters that
+    are only applied later on.
+    """
+
+    label: str
+    milliseconds: float = 0.0
+    output_features: Optional[int] = None
+    cached: bool = False
+    """The result was reused from another node of the plan."""
+    peak_memory_features: int = 0
+    """The largest memory layer created for this node."""
+    algorithms: List[AlgorithmRun] = field(default_factory=list)
+    children: List["ProfileNode"] = field(default_factory=list)
+
+    @property
+    def input_features(self) -> List[Optional[int]]:
+        return [child.output_features for child in self.children]
+
+    def to_dict(self) -> dict:
+        return dict(
+            label=self.label,
+            milliseconds=self.milliseconds,
+            input_features=self.input_features,
+            output_features=self.output_features,
+            cached=self.cached,
+            peak_memory_features=self.peak_memory_features,
+            algorithms=[asdict(a) for a in self.algorithms],
+            children=[child.to_dict() for child in self.children],
+        )
+
+    def render(self, indent: str = "") -> str:
+        """The tree as text, with the measurements of every node."""
+
+        details = [f"{self.milliseconds:.1f} ms"]
+        if self.cached:
+            details.append("reused")
+        elif self.children:
+            inputs = " + ".join(_features(c) for c in self.input_features)
+            details.append(f"{inputs} -> {_features(self.output_features)} features")
+        else:
+            details.append(f"{_features(self.output_features)} features")
+        if self.peak_memory_features:
+            details.append(f"peak memory layer {self.peak_memory_features} features")
+
+        lines = [f"{indent}{self.label}  {', '.join(details)}"]
+        lines.extend(f"{indent}  * {a.render()}" for a in self.algorithms)
+        lines.extend(child.render(indent + "  ") for child in self.children)
+        return "\n".join(lines)
+
+
+class Profiler:
+    """Builds the profile tree of a plan while it is executed, also from parallel branches."""
+
+    def __init__(self):
+        self.root: Optional[ProfileNode] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[ProfileNode]:
+        return getattr(self._local, "node", None)
+
+    def add(self, label: str) -> ProfileNode:
+        """Add a node to the current node, without measuring anything."""
+
+        parent = self.current()
+        node = ProfileNode(label)
+        with self._lock:
+            if parent is None:
+                self.root = node
+            else:
+                parent.children.append(node)
+        return node
+
+    @contextmanager
+    def node(self, label: str) -> Iterator[ProfileNode]:
+        """Add a node to the current node, measuring the time until the context is left."""
+
+        parent = self.current()
+        node = self.add(label)
+        self._local.node = node
+        start = time.perf_counter()
+        try:
+            yield node
+        finally:
+            node.milliseconds = (time.perf_counter() - start) * 1000
+            self._local.node = parent
+
+    @contextmanager
+    def branch(self, parent: Optional[ProfileNode]) -> Iterator[None]:
+        """Add the nodes created by the current thread to parent, which is in another thread."""
+
+        previous = self.current()
+        self._local.node = parent
+        try:
+            yield
+        finally:
+            self._local.node = previous
+
+    def record_algorithm(self, run: AlgorithmRun) -> None:
+        node = self.current()
+        if node is not None:
+            with self._lock:
+                node.algorithms.append(run)
+
+    def record_memory_layer(self, features: int) -> None:
+        node = self.current()
+        if node is not None:
+            with self._lock:
+                node.peak_memory_features = max(node.peak_memory_features, features)
+
+
+def save_profile(question: str, profile: ProfileNode) -> None:
+    """Append the profile to a JSON lines log in the profile directory."""
+
+    path = profile_path("plan-profiles.jsonl")
+    if os.path.exists(path) and os.path.getsize(path) > MAX_LOG_SIZE:
+        os.replace(path, f"{path}.1")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(
+            json.dumps(
+                dict(time=time.time(), question=question, plan=profile.to_dict())
+            )
+            + "\n"
+        )
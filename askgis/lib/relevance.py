@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+LAYER_NAME_WEIGHT = 3
+"""Terms in the name of a layer count this many times as much as terms in its fields."""
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+def words(text: str) -> List[str]:
+    """Split names like "roadType", "road_type" and "Road type" into lowercase words."""
+
+    return [word.lower() for word in _WORD_RE.findall(_CAMEL_RE.sub(" ", str(text)))]
+
+
+def terms(text: str) -> List[str]:
+    """The words of text plus their trigrams, so plurals and typos still match partially."""
+
+    result = []
+    for word in words(text):
+        result.append(word)
+        padded = f"^{word}$"
+        result.extend(f"#{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return result
+
+
+def estimate_tokens(text: str) -> int:
+    """A rough estimate of the number of tokens in text, about four characters per token."""
+
+    return math.ceil(len(text) / 4)
+
+
+class BM25Index:
+    """A small in-memory BM25 index over documents given as lists of terms."""
+
+    def __init__(self, documents: Iterable[List[str]]):
+        self._documents = [Counter(document) for document in documents]
+        self._lengths = [sum(document.values()) for document in self._documents]
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0
+        )
+        frequencies = Counter(
+            term for document in self._documents for term in document.keys()
+        )
+        count = len(self._documents)
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (count - n + 0.5) / (n + 0.5))
+            for term, n in frequencies.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def scores(self, query: List[str]) -> List[float]:
+        query_terms = [term for term in set(query) if term in self._idf]
+        result = []
+        for document, length in zip(self._documents, self._lengths):
+            score = 0.0
+            for term in query_terms:
+                frequency = document.get(term, 0)
+                if frequency:
+                    norm = 1 - BM25_B + BM25_B * length / (self._average_length or 1)
+                    score += (
+                        self._idf[term]
+                        * frequency
+                        * (BM25_K1 + 1)
+                        / (frequency + BM25_K1 * norm)
+                    )
+            result.append(score)
+        return result
+
+    def ranked(self, query: List[str]) -> List[Tuple[int, float]]:
+        """Indices and scores of the documents matching query, best match first."""
+
+        return sorted(
+            ((i, score) for i, score in enumerate(self.scores(query)) if score > 0),
+            key=lambda item: -item[1],
+        )
@@ -0,0 +1,167 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple, Union
+
+from langchain import OpenAI
+from langchain.agents import Agent, AgentExecutor, AgentType, load_tools
+from langchain.agents.loading import AGENT_TO_CLASS
+from langchain.callbacks import BaseCallbackHandler, CallbackManager
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+from langchain.tools import BaseTool
+
+from askgis import LOGGER
+from askgis.lib.tool_specs import load_plugin_tools
+
+
+class DispatchingCallbackHandler(BaseCallbackHandler):
+    """Forwards callbacks to the handlers bound to the current thread.
+
+    The LLM, tools and agents are shared between tasks, each running in its own thread, while
+    the callbacks (e.g. for showing progress) are different for each task.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def handlers(self) -> List[BaseCallbackHandler]:
+        return getattr(self._local, "handlers", [])
+
+    @contextmanager
+    def bound(self, handlers: Sequence[BaseCallbackHandler]) -> Iterator[None]:
+        previous = self.handlers
+        self._local.handlers = list(handlers)
+        try:
+            yield
+        finally:
+            self._local.handlers = previous
+
+    def _dispatch(self, name: str, *args: Any, **kwargs: Any) -> None:
+        for handler in self.handlers:
+            getattr(handler, name)(*args, **kwargs)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_llm_start", serialized, prompts, **kwargs)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+        self._dispatch("on_llm_new_token", token, **kwargs)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        self._dispatch("on_llm_end", response, **kwargs)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_llm_error", error, **kwargs)
+
+    def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_chain_start", serialized, inputs, **kwargs)
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+        self._dispatch("on_chain_end", outputs, **kwargs)
+
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_chain_error", error, **kwargs)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_tool_start", serialized, input_str, **kwargs)
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        self._dispatch("on_tool_end", output, **kwargs)
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._dispatch("on_tool_error", error, **kwargs)
+
+    def on_text(self, text: str, **kwargs: Any) -> Any:
+        self._dispatch("on_text", text, **kwargs)
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        self._dispatch("on_agent_action", action, **kwargs)
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        self._dispatch("on_agent_finish", finish, **kwargs)
+
+
+class Runtime:
+    """An LLM client with its tools and agents, reused by all questions using the same settings.
+
+    Only the tools that depend on the question (like the GIS tool) are passed per question.
+    """
+
+    def __init__(self, api_key: str, temperature: float, agent_type: AgentType):
+        self.callbacks = DispatchingCallbackHandler()
+        self.callback_manager = CallbackManager([self.callbacks])
+        self.llm = OpenAI(temperature=temperature, openai_api_key=api_key)
+        self.tools = load_tools(
+            ["llm-math"], llm=self.llm, callback_manager=self.callback_manager
+        )
+        self._agent_type = agent_type
+        self._agents: Dict[Tuple[str, ...], Agent] = {}
+        self._plugin_tools: Dict[str, List[BaseTool]] = {}
+        self._lock = threading.Lock()
+
+    def plugin_tools(self, manifest_url: str) -> List[BaseTool]:
+        """The tools of an AI plugin, built the first time they are needed in the session."""
+
+        with self._lock:
+            if manifest_url not in self._plugin_tools:
+                LOGGER.info(f"Loading tools of {manifest_url}")
+                self._plugin_tools[manifest_url] = load_plugin_tools(
+                    self.llm, manifest_url
+                )
+            return self._plugin_tools[manifest_url]
+
+    def executor(self, tools: Sequence[BaseTool], **kwargs: Any) -> AgentExecutor:
+        """An executor running an agent with the given and shared tools.
+
+        The prompt of an agent is built from its tools, so agents are shared between calls
+        with the same tool names, tools with the same name must keep their description.
+        """
+
+        tools = [*tools, *self.tools]
+        key = tuple(tool.name for tool in tools)
+        with self._lock:
+            if key not in self._agents:
+                self._agents[key] = AGENT_TO_CLASS[self._agent_type].from_llm_and_tools(
+                    self.llm, tools, callback_manager=self.callback_manager
+                )
+            agent = self._agents[key]
+        return AgentExecutor.from_agent_and_tools(
+            agent=agent,
+            tools=tools,
+            callback_manager=self.callback_manager,
+            verbose=True,
+            **kwargs,
+        )
+
+
+class RuntimePool:
+    """Runtimes for the session, keyed on API key, temperature and agent type.
+
+    Connections are kept alive by the openai client itself, which has a session per thread.
+    """
+
+    def __init__(self):
+        self._runtimes: Dict[Tuple[str, float, AgentType], Runtime] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str, temperature: float, agent_type: AgentType) -> Runtime:
+        with self._lock:
+            key = (api_key, temperature, agent_type)
+            if key not in self._runtimes:
+                LOGGER.info(f"Creating LLM runtime for {agent_type}")
+                self._runtimes[key] = Runtime(api_key, temperature, agent_type)
+            return self._runtimes[key]
+
+
+RUNTIMES = RuntimePool()
@@ -1,27 +1,30 @@
 from typing import Any, Dict, List, Union
 
-from langchain.callbacks import BaseCallbackHandler
-from langchain.schema import AgentAction, AgentFinish, LLMResult
 from qgis.PyQt.QtCore import QObject, pyqtSignal
 
 
 class SignalingCallbackHandler(QObject):
     llm_start = pyqtSignal(dict, list, dict)
     llm_new_token = pyqtSignal(str, dict)
-    llm_end = pyqtSignal(list, dict)
-    llm_error = pyqtSignal(dict)
+    llm_end = pyqtSignal(list, dict, dict)
+    """Generated texts, token usage (empty for cached responses) and other arguments."""
+    llm_error = pyqtSignal(object, dict)
     chain_start = pyqtSignal(dict, dict, dict)
     chain_end = pyqtSignal(dict, dict)
-    chain_error = pyqtSignal(dict)
+    chain_error = pyqtSignal(object, dict)
     tool_start = pyqtSignal(dict, str, dict)
     tool_end = pyqtSignal(str, dict)
-    tool_error = pyqtSignal(dict)
+    tool_error = pyqtSignal(object, dict)
     text = pyqtSignal(str, dict)
     agent_action = pyqtSignal(str, str, str, dict)
     agent_finish = pyqtSignal(dict, str, dict)
 
     @property
     def handler(self):
+        # langchain is only imported once the handler is needed, to keep startup fast
+        from langchain.callbacks import BaseCallbackHandler
+        from langchain.schema import AgentAction, AgentFinish, LLMResult
+
         self_ = self
 
         class Handler(BaseCallbackHandler):
@@ -35,13 +38,15 @@ class SignalingCallbackHandler(QObject):
 
             def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
                 self_.llm_end.emit(
-                    [[g.text for g in gen] for gen in response.generations], kwargs
+                    [[g.text for g in gen] for gen in response.generations],
+                    (response.llm_output or {}).get("token_usage", {}),
+                    kwargs,
                 )
 
             def on_llm_error(
                 self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
             ) -> Any:
-                self_.llm_error.emit(kwargs)
+                self_.llm_error.emit(error, kwargs)
 
             def on_chain_start(
                 self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
@@ -54,7 +59,7 @@ class SignalingCallbackHandler(QObject):
             def on_chain_error(
                 self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
             ) -> Any:
-                self_.chain_error.emit(kwargs)
+                self_.chain_error.emit(error, kwargs)
 
             def on_tool_start(
                 self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
@@ -67,7 +72,7 @@ class SignalingCallbackHandler(QObject):
             def on_tool_error(
                 self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
             ) -> Any:
-                self_.tool_error.emit(kwargs)
+                self_.tool_error.emit(error, kwargs)
 
             def on_text(self, text: str, **kwargs: Any) -> Any:
                 self_.text.emit(text, kwargs)
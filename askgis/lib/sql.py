@@ -0,0 +1,381 @@
+from dataclasses import dataclass
+from itertools import count
+from typing import Any, List, Optional, Tuple
+
+from qgis.core import (
+    QgsAbstractDatabaseProviderConnection,
+    QgsDataProvider,
+    QgsDataSourceUri,
+    QgsFields,
+    QgsProject,
+    QgsProviderConnectionException,
+    QgsProviderRegistry,
+    QgsUnitTypes,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+
+from askgis import LOGGER
+from askgis.lib.context import Context
+from askgis.lib.executor import (
+    Action,
+    BufferedLayer,
+    CountAction,
+    DifferenceLayer,
+    FilteredLayer,
+    IntersectionLayer,
+    Layer,
+    MultiValueFilteredLayer,
+    SelectAction,
+    SourceLayer,
+    UnionLayer,
+    WithinDistanceLayer,
+    coerce_value,
+    find_layer,
+)
+from askgis.lib.util import to_snake_case
+from askgis.lib.value_index import resolve_values
+
+
+class NotCompilable(Exception):
+    """Raised when (a part of) a plan cannot be pushed down to a database."""
+
+
+@dataclass
+class DatabaseTable:
+    provider: str
+    """Key of the provider used to create connections (postgres, spatialite or ogr)."""
+    connection_uri: str
+    schema: str
+    table: str
+
+
+def database_table(layer: QgsVectorLayer) -> DatabaseTable:
+    """Figure out in which database table the data of the layer is stored."""
+
+    provider = layer.providerType()
+    if provider in ("postgres", "spatialite"):
+        uri = QgsDataSourceUri(layer.source())
+        if uri.table().startswith("("):
+            raise NotCompilable(f"{layer.name()} is a query layer")
+        if provider == "postgres":
+            connection_uri = uri.connectionInfo(False)
+        else:
+            connection_uri = f"dbname='{uri.database()}'"
+        return DatabaseTable(provider, connection_uri, uri.schema(), uri.table())
+    elif provider == "ogr":
+        parts = QgsProviderRegistry.instance().decodeUri(provider, layer.source())
+        if not parts.get("path", "").lower().endswith(".gpkg"):
+            raise NotCompilable(f"{layer.name()} is not stored in a GeoPackage")
+        table = parts.get("layerName")
+        if not table:
+            sublayers = layer.dataProvider().subLayers()
+            if len(sublayers) != 1:
+                raise NotCompilable(f"Cannot figure out the table of {layer.name()}")
+            table = sublayers[0].split(QgsDataProvider.sublayerSeparator())[1]
+        return DatabaseTable(provider, parts["path"], "", table)
+    raise NotCompilable(f"{layer.name()} is not stored in a supported database")
+
+
+@dataclass
+class Relation:
+    """A compiled layer, a SELECT yielding __fid, __geom and the attribute columns."""
+
+    sql: str
+    columns: List[str]
+    origin: QgsVectorLayer
+    """The layer whose features the rows are derived from."""
+    geometry_type: QgsWkbTypes.GeometryType
+
+
+@dataclass
+class CompiledQuery:
+    connection: QgsAbstractDatabaseProviderConnection
+    sql: str
+    origin: QgsVectorLayer
+    key_column: str
+
+
+def _identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqlCompiler:
+    """Compiles an action into a single spatial SQL query.
+
+    Only possible if all source layers come from the same database, share a CRS and are
+    stored in a SpatiaLite, GeoPackage or PostGIS database. Overlays and distances are only
+    pushed down to PostGIS, see _check_spatial_join.
+    """
+
+    def __init__(self, project: QgsProject, context: Optional[Context] = None):
+        self._project = project
+        self._context = context
+        self._table: Optional[DatabaseTable] = None
+        self._connection: Optional[QgsAbstractDatabaseProviderConnection] = None
+        self._crs = None
+        self._aliases = count()
+
+    def compile(self, action: Action) -> CompiledQuery:
+        relation = self._compile_layer(action.layer)
+        key_column = self._key_column(relation.origin)
+        alias = self._alias()
+        if isinstance(action, CountAction):
+            sql = f"SELECT COUNT(*) FROM ({relation.sql}) AS {alias}"
+        elif isinstance(action, SelectAction):
+            sql = f"SELECT DISTINCT __fid FROM ({relation.sql}) AS {alias}"
+        else:
+            raise NotCompilable(f"Unsupported action {action.__class__.__name__}")
+        return CompiledQuery(
+            connection=self._connection,
+            sql=sql,
+            origin=relation.origin,
+            key_column=key_column,
+        )
+
+    def _alias(self) -> str:
+        return f"t{next(self._aliases)}"
+
+    def _compile_layer(self, layer: Layer) -> Relation:
+        method = getattr(
+            self, f"_compile_{to_snake_case(layer.__class__.__name__)}", None
+        )
+        if method is None:
+            raise NotCompilable(f"Unsupported layer {layer.__class__.__name__}")
+        return method(layer)
+
+    def _key_column(self, layer: QgsVectorLayer) -> str:
+        table = database_table(layer)
+        keys = self._connection.table(table.schema, table.table).primaryKeyColumns()
+        if len(keys) != 1:
+            raise NotCompilable(f"{layer.name()} does not have a single primary key")
+        return keys[0]
+
+    def _literal(self, value: Any) -> str:
+        if isinstance(value, bool):
+            if self._table.provider == "postgres":
+                return "TRUE" if value else "FALSE"
+            return "1" if value else "0"
+        elif isinstance(value, (int, float)):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def _check_spatial_join(self) -> None:
+        if self._table.provider != "postgres":
+            # the correlated subqueries cannot use the R-tree of a SpatiaLite or GeoPackage
+            # database, so every pair of features is compared, which is slower than the
+            # indexed overlays of the executor
+            raise NotCompilable("Spatial joins are only pushed down to PostGIS")
+
+    def _compile_source_layer(self, layer: SourceLayer) -> Relation:
+        original = find_layer(self._project, layer.id)
+        if not isinstance(original, QgsVectorLayer):
+            raise NotCompilable(f"{layer.id} is not a vector layer")
+
+        table = database_table(original)
+        if self._table is None:
+            self._table = table
+            self._connection = (
+                QgsProviderRegistry.instance()
+                .providerMetadata(table.provider)
+                .createConnection(table.connection_uri, {})
+            )
+            self._crs = original.crs()
+        elif (table.provider, table.connection_uri) != (
+            self._table.provider,
+            self._table.connection_uri,
+        ):
+            raise NotCompilable("The plan uses layers from different databases")
+        elif original.crs() != self._crs:
+            raise NotCompilable("The plan uses layers with different CRSes")
+
+        geometry_column = self._connection.table(
+            table.schema, table.table
+        ).geometryColumn()
+        key_column = self._key_column(original)
+        fields = original.fields()
+        columns = [
+            fields.at(i).name()
+            for i in range(fields.count())
+            if fields.fieldOrigin(i) == QgsFields.OriginProvider
+        ]
+
+        name = _identifier(table.table)
+        if table.schema:
+            name = f"{_identifier(table.schema)}.{name}"
+        sql = (
+            f"SELECT {_identifier(key_column)} AS __fid, {_identifier(geometry_column)} AS __geom"
+            f"{''.join(', ' + _identifier(c) for c in columns)} FROM {name}"
+        )
+        if original.subsetString():
+            sql += f" WHERE {original.subsetString()}"
+        return Relation(sql, columns, original, original.geometryType())
+
+    def _compile_filter(
+        self, source: Relation, field: str, values: List[Any]
+    ) -> Relation:
+        if field not in source.columns:
+            raise NotCompilable(f"Unknown field: {field}")
+        values = resolve_values(
+            source.origin,
+            field,
+            [coerce_value(source.origin, field, value) for value in values],
+            self._context.field_labels(source.origin.id(), field)
+            if self._context
+            else None,
+        )
+        if len(values) == 1:
+            condition = f"{_identifier(field)} = {self._literal(values[0])}"
+        else:
+            condition = f"{_identifier(field)} IN ({', '.join(self._literal(v) for v in values)})"
+        return Relation(
+            f"SELECT * FROM ({source.sql}) AS {self._alias()} WHERE {condition}",
+            source.columns,
+            source.origin,
+            source.geometry_type,
+        )
+
+    def _compile_filtered_layer(self, layer: FilteredLayer) -> Relation:
+        return self._compile_filter(
+            self._compile_layer(layer.source), layer.field, [layer.value]
+        )
+
+    def _compile_multi_value_filtered_layer(
+        self, layer: MultiValueFilteredLayer
+    ) -> Relation:
+        return self._compile_filter(
+            self._compile_layer(layer.source), layer.field, list(layer.values)
+        )
+
+    def _compile_buffered_layer(self, layer: BufferedLayer) -> Relation:
+        source = self._compile_layer(layer.source)
+        if self._crs.mapUnits() != QgsUnitTypes.DistanceMeters:
+            raise NotCompilable("Buffering is only pushed down for metric CRSes")
+        return Relation(
+            f"SELECT __fid, ST_Buffer(__geom, {float(layer.distance)!r}) AS __geom"
+            f"{''.join(', ' + _identifier(c) for c in source.columns)}"
+            f" FROM ({source.sql}) AS {self._alias()}",
+            source.columns,
+            source.origin,
+            QgsWkbTypes.PolygonGeometry,
+        )
+
+    def _compile_union_layer(self, layer: UnionLayer) -> Relation:
+        source_a = self._compile_layer(layer.source_a)
+        source_b = self._compile_layer(layer.source_b)
+        if source_a.origin is not source_b.origin:
+            # native:union splits overlapping geometries from different layers
+            raise NotCompilable("Union is only pushed down for a single layer")
+        # features are the same if their key is, no matter how the database compares geometries
+        a, b, b2 = self._alias(), self._alias(), self._alias()
+        return Relation(
+            f"SELECT * FROM ({source_a.sql}) AS {a}"
+            f" UNION ALL SELECT * FROM ({source_b.sql}) AS {b}"
+            f" WHERE NOT EXISTS (SELECT 1 FROM ({source_a.sql}) AS {b2}"
+            f" WHERE {b2}.__fid = {b}.__fid)",
+            source_a.columns,
+            source_a.origin,
+            source_a.geometry_type,
+        )
+
+    def _overlay(self, layer: Layer) -> Tuple[Relation, Relation, str, str, str, str]:
+        source_a = self._compile_layer(layer.source_a)
+        source_b = self._compile_layer(layer.source_b)
+        self._check_spatial_join()
+        a, b, b2 = self._alias(), self._alias(), self._alias()
+        columns = "".join(f", {a}.{_identifier(c)}" for c in source_a.columns)
+        touching = f"SELECT 1 FROM ({source_b.sql}) AS {b} WHERE ST_Intersects({a}.__geom, {b}.__geom)"
+        touching_union = (
+            f"SELECT ST_Union({b2}.__geom) FROM ({source_b.sql}) AS {b2}"
+            f" WHERE ST_Intersects({a}.__geom, {b2}.__geom)"
+        )
+        return source_a, source_b, a, columns, touching, touching_union
+
+    def _compile_intersection_layer(self, layer: IntersectionLayer) -> Relation:
+        source_a, source_b, a, columns, touching, touching_union = self._overlay(layer)
+        if (
+            source_a.geometry_type == QgsWkbTypes.PolygonGeometry
+            and source_b.geometry_type == QgsWkbTypes.LineGeometry
+        ):
+            # same special case as in the executor, keep the polygons that touch lines
+            geometry = f"{a}.__geom"
+        else:
+            geometry = f"ST_Intersection({a}.__geom, ({touching_union}))"
+        return Relation(
+            f"SELECT {a}.__fid, {geometry} AS __geom{columns}"
+            f" FROM ({source_a.sql}) AS {a} WHERE EXISTS ({touching})",
+            source_a.columns,
+            source_a.origin,
+            source_a.geometry_type,
+        )
+
+    def _compile_difference_layer(self, layer: DifferenceLayer) -> Relation:
+        source_a, source_b, a, columns, touching, touching_union = self._overlay(layer)
+        geometry = (
+            f"CASE WHEN EXISTS ({touching})"
+            f" THEN ST_Difference({a}.__geom, ({touching_union})) ELSE {a}.__geom END"
+        )
+        return Relation(
+            f"SELECT * FROM (SELECT {a}.__fid, {geometry} AS __geom{columns}"
+            f" FROM ({source_a.sql}) AS {a}) AS {self._alias()}"
+            " WHERE __geom IS NOT NULL AND NOT ST_IsEmpty(__geom)",
+            source_a.columns,
+            source_a.origin,
+            source_a.geometry_type,
+        )
+
+    def _compile_within_distance_layer(self, layer: WithinDistanceLayer) -> Relation:
+        source = self._compile_layer(layer.source)
+        target = self._compile_layer(layer.target)
+        self._check_spatial_join()
+        if self._crs.mapUnits() != QgsUnitTypes.DistanceMeters:
+            raise NotCompilable("Distances are only pushed down for metric CRSes")
+        a, b = self._alias(), self._alias()
+        # unlike ST_Distance, ST_DWithin can use the spatial index
+        condition = f"ST_DWithin({a}.__geom, {b}.__geom, {float(layer.distance)!r})"
+        return Relation(
+            f"SELECT * FROM ({source.sql}) AS {a}"
+            f" WHERE EXISTS (SELECT 1 FROM ({target.sql}) AS {b} WHERE {condition})",
+            source.columns,
+            source.origin,
+            source.geometry_type,
+        )
+
+
+def execute_in_database(
+    project: QgsProject, action: Action, context: Optional[Context] = None
+) -> Optional[str]:
+    """Try to execute the action as a single SQL query, returns None if not possible."""
+
+    try:
+        query = SqlCompiler(project, context).compile(action)
+    except NotCompilable as e:
+        LOGGER.info(f"Not pushing plan down to the database: {e}")
+        return None
+
+    LOGGER.info(f"Pushing plan down to the database: {query.sql}")
+    try:
+        rows = query.connection.executeSql(query.sql)
+    except QgsProviderConnectionException as e:
+        LOGGER.warning(f"Could not execute plan in the database: {e}")
+        return None
+
+    if isinstance(action, CountAction):
+        count = int(rows[0][0])
+        if count == 1:
+            return "There is 1 matching feature"
+        return f"There are {count} matching features"
+
+    ids = [row[0] for row in rows]
+    if query.origin.providerType() == "postgres":
+        # the PostgreSQL provider does not necessarily use the primary key as feature id
+        query.origin.selectByExpression(
+            f"{_identifier(query.key_column)} IN ({', '.join(repr(i) for i in ids) or 'NULL'})",
+            QgsVectorLayer.SetSelection,
+        )
+    else:
+        query.origin.selectByIds(ids, QgsVectorLayer.SetSelection)
+
+    if query.origin.selectedFeatureCount() == 1:
+        return "Selected 1 item"
+    return f"Selected {query.origin.selectedFeatureCount()} items"
@@ -0,0 +1,244 @@
+import re
+import sqlite3
+import time
+from functools import partial
+from threading import RLock
+from typing import Any, Iterable, Optional, Set
+
+from qgis.core import (
+    QgsExpression,
+    QgsExpressionContext,
+    QgsExpressionContextUtils,
+    QgsFeatureRequest,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from askgis import LOGGER
+from askgis.lib.field_summaries import MAX_AGE, layer_fingerprint
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+SEARCH_EXPRESSION_PROPERTY = "askgis/searchExpression"
+"""Custom layer property with the expression producing the text to index for a feature."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS layers (
+    key TEXT PRIMARY KEY,
+    expression TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    layer TEXT NOT NULL,
+    fid INTEGER NOT NULL,
+    UNIQUE (layer, fid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(
+    text, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+_SEPARATOR = ", ' ', "
+
+_QUERY_TERM_RE = re.compile(r"[^\W_]+\*?")
+
+
+def search_expression(layer: QgsVectorLayer) -> str:
+    """The expression producing the text to index, by default all string fields."""
+
+    expression = layer.customProperty(SEARCH_EXPRESSION_PROPERTY)
+    if expression:
+        return expression
+    columns = [
+        QgsExpression.quotedColumnRef(field.name())
+        for field in layer.fields()
+        if field.type() == QVariant.String
+    ]
+    return f"concat({_SEPARATOR.join(columns)})" if columns else "''"
+
+
+def fts_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching all words, words ending in * are prefixes.
+
+    OR between two words matches either of them, any other operator is matched as a word.
+    """
+
+    terms = []
+    for term in _QUERY_TERM_RE.findall(query):
+        if term == "OR":
+            # FTS5 fails on an OR without a word on both sides
+            if terms and terms[-1] != "OR":
+                terms.append(term)
+        elif term.endswith("*"):
+            terms.append(f'"{term[:-1]}"*')
+        else:
+            terms.append(f'"{term}"')
+    if terms and terms[-1] == "OR":
+        terms.pop()
+    return " ".join(terms)
+
+
+def _layer_key(layer: QgsVectorLayer) -> str:
+    return f"{layer.providerType()}|{layer.source()}"
+
+
+class TextIndex:
+    """A persistent full-text index over the features of layers.
+
+    The text of each feature is produced by search_expression and stored in an SQLite FTS5
+    table in the profile directory. A layer is indexed on its first search and, after that,
+    updated from the edits committed in QGIS. It is rebuilt when its data changed outside of
+    QGIS or its expression changed.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._watched: Set[str] = set()
+        self._lock = RLock()
+
+    def _db(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._connection is None:
+                if self._path is None:
+                    self._path = profile_path("text-index.sqlite")
+                # shared between the task threads and the main thread, guarded by the lock
+                self._connection = sqlite3.connect(self._path, check_same_thread=False)
+                self._connection.executescript(_SCHEMA)
+            return self._connection
+
+    def search(self, layer: QgsVectorLayer, query: str) -> Set[int]:
+        """Ids of the features of layer matching the query."""
+
+        match = fts_query(query)
+        if not match:
+            return set()
+        with self._lock:
+            key = self._ensure(layer)
+            rows = self._db().execute(
+                "SELECT entries.fid FROM documents"
+                " JOIN entries ON entries.id = documents.rowid"
+                " WHERE documents MATCH ? AND entries.layer = ?",
+                (match, key),
+            )
+            return {row[0] for row in rows}
+
+    def _ensure(self, layer: QgsVectorLayer) -> str:
+        key = _layer_key(layer)
+        expression = search_expression(layer)
+        fingerprint = layer_fingerprint(layer)
+        row = (
+            self._db()
+            .execute(
+                "SELECT expression, fingerprint, created FROM layers WHERE key = ?",
+                (key,),
+            )
+            .fetchone()
+        )
+        if (
+            row is None
+            or row[0] != expression
+            or row[1] != fingerprint
+            # without a modification time changes outside of QGIS cannot be detected
+            or (fingerprint.endswith("|None") and time.time() - row[2] > MAX_AGE)
+        ):
+            self._rebuild(layer, key, expression, fingerprint)
+        self._watch(layer)
+        return key
+
+    def _rebuild(
+        self, layer: QgsVectorLayer, key: str, expression: str, fingerprint: str
+    ) -> None:
+        LOGGER.info(f"Building the text index of {layer.name()}")
+        db = self._db()
+        with db:
+            self._remove(key, None)
+            self._add(layer, key, None)
+            db.execute(
+                "INSERT OR REPLACE INTO layers (key, expression, fingerprint, created)"
+                " VALUES (?, ?, ?, ?)",
+                (key, expression, fingerprint, time.time()),
+            )
+
+    def _add(
+        self, layer: QgsVectorLayer, key: str, fids: Optional[Iterable[int]]
+    ) -> None:
+        expression = QgsExpression(search_expression(layer))
+        if expression.hasParserError():
+            raise ValueError(
+                f"Invalid search expression for {layer.name()}: {expression.parserErrorString()}"
+            )
+        context = QgsExpressionContext(
+            QgsExpressionContextUtils.globalProjectLayerScopes(layer)
+        )
+        expression.prepare(context)
+
+        request = QgsFeatureRequest()
+        if fids is not None:
+            request.setFilterFids(list(fids))
+        if not expression.needsGeometry():
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(expression.referencedColumns(), layer.fields())
+
+        db = self._db()
+        for feature in layer.getFeatures(request):
+            context.setFeature(feature)
+            text = expression.evaluate(context)
+            if text is None or (isinstance(text, QVariant) and text.isNull()):
+                continue
+            rowid = db.execute(
+                "INSERT INTO entries (layer, fid) VALUES (?, ?)", (key, feature.id())
+            ).lastrowid
+            db.execute(
+                "INSERT INTO documents (rowid, text) VALUES (?, ?)", (rowid, str(text))
+            )
+
+    def _remove(self, key: str, fids: Optional[Iterable[int]]) -> None:
+        db = self._db()
+        if fids is None:
+            condition, parameters = "layer = ?", [key]
+        else:
+            fids = list(fids)
+            condition = f"layer = ? AND fid IN ({', '.join('?' * len(fids))})"
+            parameters = [key, *fids]
+        db.execute(
+            f"DELETE FROM documents WHERE rowid IN (SELECT id FROM entries WHERE {condition})",
+            parameters,
+        )
+        db.execute(f"DELETE FROM entries WHERE {condition}", parameters)
+
+    def _watch(self, layer: QgsVectorLayer) -> None:
+        if layer.id() in self._watched:
+            return
+        self._watched.add(layer.id())
+        layer.committedFeaturesAdded.connect(
+            lambda _id, features: self._update(layer, [f.id() for f in features])
+        )
+        layer.committedFeaturesRemoved.connect(
+            lambda _id, fids: self._update(layer, fids, removed=True)
+        )
+        layer.committedAttributeValuesChanges.connect(
+            lambda _id, changes: self._update(layer, changes.keys())
+        )
+        layer.willBeDeleted.connect(partial(self._watched.discard, layer.id()))
+
+    def _update(
+        self, layer: QgsVectorLayer, fids: Iterable[Any], removed: bool = False
+    ) -> None:
+        fids = list(fids)
+        key = _layer_key(layer)
+        with self._lock:
+            db = self._db()
+            with db:
+                self._remove(key, fids)
+                if not removed:
+                    self._add(layer, key, fids)
+                # the edits are in the index, so the changed file does not require a rebuild
+                db.execute(
+                    "UPDATE layers SET fingerprint = ? WHERE key = ?",
+                    (layer_fingerprint(layer), key),
+                )
+
+
+TEXT_INDEX = TextIndex()
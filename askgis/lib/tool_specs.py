@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+from urllib.request import url2pathname
+
+import requests
+from langchain.agents.agent_toolkits import NLAToolkit
+from langchain.schema import BaseLanguageModel
+from langchain.tools import BaseTool
+from langchain.tools.openapi.utils.openapi_utils import OpenAPISpec
+from langchain.tools.plugin import AIPlugin
+
+from askgis import LOGGER
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+DEFAULT_TTL = 24 * 60 * 60
+"""Cached specs older than this many seconds are revalidated (in the background)."""
+REQUEST_TIMEOUT = 10
+
+
+def _as_url(location: str) -> str:
+    """URLs are kept as they are, local paths are turned into file:// URLs."""
+
+    if urlparse(location).scheme in ("http", "https", "file"):
+        return location
+    return Path(location).resolve().as_uri()
+
+
+class ToolSpecCache:
+    """Caches the manifests and OpenAPI specs of external tools on disk.
+
+    A cached spec is always used as is, if it is older than the TTL it is revalidated in the
+    background using a conditional request, so the network is only waited for the very first
+    time a spec is needed. Local files (and file:// URLs) are read directly.
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = DEFAULT_TTL):
+        self._directory = directory
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._revalidating: Dict[str, threading.Thread] = {}
+
+    def _path(self, url: str) -> str:
+        if self._directory is None:
+            self._directory = profile_path("tool-specs")
+        os.makedirs(self._directory, exist_ok=True)
+        return os.path.join(
+            self._directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def _load(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, entry: dict) -> None:
+        path = self._path(url)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.tmp", path)
+
+    def get(self, location: str) -> str:
+        """The content at the location, from the cache if possible."""
+
+        url = _as_url(location)
+        if url.startswith("file:"):
+            with open(url2pathname(urlparse(url).path), encoding="utf-8") as f:
+                return f.read()
+
+        entry = self._load(url)
+        if entry is None:
+            return self._fetch(url, None)["body"]
+        if time.time() - entry["fetched"] > self._ttl:
+            self._revalidate_in_background(url, entry)
+        return entry["body"]
+
+    def _fetch(self, url: str, entry: Optional[dict]) -> dict:
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and entry is not None:
+            entry = dict(entry, fetched=time.time())
+        else:
+            response.raise_for_status()
+            entry = dict(
+                body=response.text,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                fetched=time.time(),
+            )
+        self._store(url, entry)
+        return entry
+
+    def _revalidate_in_background(self, url: str, entry: dict) -> None:
+        def revalidate():
+            try:
+                self._fetch(url, entry)
+            except (requests.RequestException, OSError) as e:
+                LOGGER.warning(f"Could not revalidate {url}: {e}")
+            finally:
+                with self._lock:
+                    self._revalidating.pop(url, None)
+
+        with self._lock:
+            if url in self._revalidating:
+                return
+            thread = threading.Thread(target=revalidate, daemon=True)
+            self._revalidating[url] = thread
+        thread.start()
+
+
+TOOL_SPECS = ToolSpecCache()
+
+
+def load_plugin_tools(
+    llm: BaseLanguageModel, manifest_url: str, cache: ToolSpecCache = TOOL_SPECS
+) -> List[BaseTool]:
+    """Build the tools of an AI plugin, reading its manifest and OpenAPI spec from the cache."""
+
+    manifest = AIPlugin(**json.loads(cache.get(manifest_url)))
+    spec_url = urljoin(_as_url(manifest_url), manifest.api.url)
+    spec = OpenAPISpec.from_text(cache.get(spec_url))
+    return NLAToolkit.from_llm_and_spec(llm, spec).get_tools()
@@ -0,0 +1,255 @@
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from qgis.core import QgsSettings
+
+from askgis import LOGGER
+from askgis.qgis_plugin_tools.tools.resources import profile_path
+
+MAX_TRACE_FILES = 100
+"""The oldest trace files are removed when there are more than this."""
+
+
+def tracing_enabled() -> bool:
+    return QgsSettings().value("/AskGIS/traceQuestions", False, type=bool)
+
+
+@dataclass
+class Span:
+    name: str
+    stage: str
+    """The kind of work (e.g. llm:OpenAI or executor:buffer) to keep statistics for."""
+    span_id: str
+    parent: Optional["Span"] = field(default=None, repr=False)
+    thread: int = field(default_factory=threading.get_ident)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def milliseconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Tracer:
+    """Collects the spans of a question, from any thread.
+
+    Spans started by a thread are children of the span that thread is currently in, see
+    branch for continuing a span in another thread.
+    """
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Span]:
+        return getattr(self._local, "span", None)
+
+    def start(self, name: str, stage: str, **attributes: Any) -> Span:
+        span = Span(
+            name,
+            stage,
+            secrets.token_hex(8),
+            parent=self.current(),
+            attributes=attributes,
+        )
+        self._local.span = span
+        return span
+
+    def end(
+        self, span: Span, error: Optional[BaseException] = None, **attributes: Any
+    ) -> None:
+        span.end_ns = time.time_ns()
+        span.attributes.update(attributes)
+        if error is not None:
+            span.error = f"{error.__class__.__name__}: {error}"
+        self._local.span = span.parent
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, stage: str, **attributes: Any) -> Iterator[Span]:
+        span = self.start(name, stage, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        self.end(span)
+
+    @contextmanager
+    def branch(self, parent: Optional[Span]) -> Iterator[None]:
+        """Make the spans started by the current thread children of parent."""
+
+        previous = self.current()
+        self._local.span = parent
+        try:
+            yield
+        finally:
+            self._local.span = previous
+
+    def chrome_trace(self) -> dict:
+        """The spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+
+        return dict(
+            traceEvents=[
+                dict(
+                    name=span.name,
+                    cat=span.stage,
+                    ph="X",
+                    ts=span.start_ns / 1000,
+                    dur=(span.end_ns - span.start_ns) / 1000,
+                    pid=os.getpid(),
+                    tid=span.thread,
+                    args=dict(
+                        span.attributes,
+                        **({"error": span.error} if span.error else {}),
+                    ),
+                )
+                for span in self.spans
+            ],
+            displayTimeUnit="ms",
+        )
+
+    def otlp_trace(self) -> dict:
+        """The spans in the OpenTelemetry (OTLP) JSON format."""
+
+        return dict(
+            resourceSpans=[
+                dict(
+                    resource=dict(
+                        attributes=[_otlp_attribute("service.name", "askgis")]
+                    ),
+                    scopeSpans=[
+                        dict(
+                            scope=dict(name="askgis"),
+                            spans=[self._otlp_span(span) for span in self.spans],
+                        )
+                    ],
+                )
+            ]
+        )
+
+    def _otlp_span(self, span: Span) -> dict:
+        result = dict(
+            traceId=self.trace_id,
+            spanId=span.span_id,
+            name=span.name,
+            kind=1,
+            startTimeUnixNano=str(span.start_ns),
+            endTimeUnixNano=str(span.end_ns),
+            attributes=[
+                _otlp_attribute(key, value)
+                for key, value in dict(span.attributes, stage=span.stage).items()
+            ],
+            status=dict(code=2, message=span.error) if span.error else dict(code=1),
+        )
+        if span.parent is not None:
+            result["parentSpanId"] = span.parent.span_id
+        return result
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return dict(key=key, value=dict(boolValue=value))
+    if isinstance(value, int):
+        return dict(key=key, value=dict(intValue=str(value)))
+    if isinstance(value, float):
+        return dict(key=key, value=dict(doubleValue=value))
+    return dict(key=key, value=dict(stringValue=str(value)))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class LatencyStats:
+    """The latest durations per stage, kept over sessions in the profile directory."""
+
+    def __init__(self, path: Optional[str] = None, window: int = 500):
+        self._path = path
+        self._window = window
+        self._durations: Optional[Dict[str, List[float]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, List[float]]:
+        if self._durations is None:
+            if self._path is None:
+                self._path = profile_path("latency-stats.json")
+            try:
+                with open(self._path, encoding="utf-8") as f:
+                    self._durations = json.load(f)
+            except (OSError, ValueError):
+                self._durations = {}
+        return self._durations
+
+    def add(self, spans: List[Span]) -> None:
+        with self._lock:
+            durations = self._load()
+            for span in spans:
+                stage = durations.setdefault(span.stage, [])
+                stage.append(span.milliseconds)
+                del stage[: -self._window]
+            with open(self._path, "w", encoding="utf-8") as f:
+                json.dump(durations, f)
+
+    def percentiles(self) -> Dict[str, Tuple[int, float, float]]:
+        """The number of durations, p50 and p95 (in ms) per stage."""
+
+        with self._lock:
+            return {
+                stage: (
+                    len(values),
+                    _percentile(values, 0.5),
+                    _percentile(values, 0.95),
+                )
+                for stage, values in sorted(self._load().items())
+                if values
+            }
+
+    def log(self) -> None:
+        LOGGER.info(
+            "Latencies: "
+            + ", ".join(
+                f"{stage} p50 {p50:.0f} ms p95 {p95:.0f} ms (n={count})"
+                for stage, (count, p50, p95) in self.percentiles().items()
+            )
+        )
+
+
+LATENCIES = LatencyStats()
+
+
+def save_trace(tracer: Tracer) -> None:
+    """Add the trace to the latency statistics, and write it to files if enabled."""
+
+    LATENCIES.add(tracer.spans)
+    if not tracing_enabled():
+        return
+
+    directory = profile_path("traces")
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{tracer.trace_id[:8]}"
+    for suffix, content in (
+        ("trace.json", tracer.chrome_trace()),
+        ("otlp.json", tracer.otlp_trace()),
+    ):
+        with open(
+            os.path.join(directory, f"{name}.{suffix}"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(content, f)
+
+    files = sorted(os.listdir(directory))
+    for old in files[: max(0, len(files) - 2 * MAX_TRACE_FILES)]:
+        os.remove(os.path.join(directory, old))
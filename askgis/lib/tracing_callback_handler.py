@@ -0,0 +1,93 @@
+from typing import Any, Dict, List, Optional, Union
+
+from langchain.callbacks import BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+from askgis.lib.tracing import Span, Tracer
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records spans for the chains, LLM calls, tools and agent steps of a question."""
+
+    def __init__(self, tracer: Tracer):
+        self._tracer = tracer
+        self._open: Dict[str, List[Span]] = dict(chain=[], llm=[], tool=[], agent=[])
+
+    def _start(self, kind: str, name: str, **attributes: Any) -> None:
+        self._open[kind].append(
+            self._tracer.start(name, f"{kind}:{name}", **attributes)
+        )
+
+    def _end(
+        self, kind: str, error: Optional[BaseException] = None, **attributes: Any
+    ) -> None:
+        if self._open[kind]:
+            self._tracer.end(self._open[kind].pop(), error, **attributes)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> Any:
+        self._start(
+            "llm",
+            serialized.get("name", "llm"),
+            prompt_characters=sum(len(p) for p in prompts),
+        )
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+        pass
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        # not included for responses from the cache
+        usage = (response.llm_output or {}).get("token_usage", {})
+        self._end(
+            "llm",
+            cached=not usage,
+            **{
+                key: usage[key]
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+                if key in usage
+            },
+        )
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._end("llm", error)
+
+    def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
+    ) -> Any:
+        self._start("chain", serialized.get("name", "chain"))
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+        self._end("chain")
+
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._end("chain", error)
+
+    def on_text(self, text: str, **kwargs: Any) -> Any:
+        pass
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        # a step lasts from the action until its tool is done
+        self._start("agent", "step", tool=action.tool, tool_input=action.tool_input)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+    ) -> Any:
+        self._start("tool", serialized.get("name", "tool"))
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        self._end("tool")
+        self._end("agent")
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._end("tool", error)
+        self._end("agent", error)
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        self._end("agent")
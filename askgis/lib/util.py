@@ -1,7 +1,19 @@
 import re
+from dataclasses import dataclass
 
 TO_SNAKE_PATTERN = re.compile(r"(?<!^)(?=[A-Z])")
 
 
 def to_snake_case(name: str) -> str:
     return TO_SNAKE_PATTERN.sub("_", name).lower()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
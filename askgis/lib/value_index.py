@@ -0,0 +1,159 @@
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from qgis.core import QgsVectorLayer
+from qgis.PyQt.QtCore import QVariant
+
+from askgis import LOGGER
+from askgis.lib.layer_cache import LayerCache
+
+MIN_SIMILARITY = 0.5
+"""Minimum trigram similarity (Dice coefficient) for a value to be considered a match."""
+MAX_INDEXED_VALUES = 100_000
+"""Fields with more distinct values than this are not indexed, values are used as they are."""
+
+_SEPARATORS_RE = re.compile(r"[\W_]+")
+
+
+def normalize(value: Any) -> str:
+    """Lowercase, without accents and with any punctuation replaced by a single space."""
+
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _SEPARATORS_RE.sub(" ", text.casefold()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ValueIndex:
+    """Maps values given by the LLM to the actual values of a field.
+
+    Values are looked up exactly, then by their normalized form or the normalized form of
+    their label, and, if fuzzy, by the trigram similarity to any of those.
+    """
+
+    def __init__(
+        self,
+        values: Iterable[Any],
+        labels: Optional[Dict[Any, str]] = None,
+        fuzzy: bool = True,
+    ):
+        self._values = set(values)
+        self._fuzzy = fuzzy
+        self._normalized: Dict[str, List[Any]] = {}
+        for value in self._values:
+            self._add(normalize(value), value)
+        for value, label in (labels or {}).items():
+            if value in self._values:
+                self._add(normalize(label), value)
+
+        self._trigrams: Dict[str, Set[str]] = {}
+        if fuzzy:
+            for key in self._normalized:
+                for trigram in trigrams(key):
+                    self._trigrams.setdefault(trigram, set()).add(key)
+
+    def _add(self, key: str, value: Any) -> None:
+        values = self._normalized.setdefault(key, [])
+        if value not in values:
+            values.append(value)
+
+    def resolve(self, value: Any) -> List[Any]:
+        """The actual values matching value, best matches only, empty if nothing matches."""
+
+        if value in self._values:
+            return [value]
+        key = normalize(value)
+        if key in self._normalized:
+            return list(self._normalized[key])
+        if not self._fuzzy or not key:
+            return []
+
+        query = trigrams(key)
+        shared: Dict[str, int] = {}
+        for trigram in query:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        similarities = {
+            candidate: 2 * n / (len(query) + len(trigrams(candidate)))
+            for candidate, n in shared.items()
+        }
+        best = max(similarities.values(), default=0)
+        if best < MIN_SIMILARITY:
+            return []
+        return [
+            value
+            for candidate, similarity in similarities.items()
+            if similarity == best
+            for value in self._normalized[candidate]
+        ]
+
+
+VALUE_INDEXES = LayerCache(max_entries=256)
+"""Session cache for the value indexes, dropped whenever the data of a layer changes."""
+
+
+def value_index(
+    layer: QgsVectorLayer, field: str, labels: Optional[Dict[Any, str]] = None
+) -> ValueIndex:
+    """The (cached) value index of the field, built on first use."""
+
+    idx = layer.fields().lookupField(field)
+
+    def build() -> ValueIndex:
+        values = layer.uniqueValues(idx, MAX_INDEXED_VALUES + 1)
+        if len(values) > MAX_INDEXED_VALUES:
+            # a partial index could resolve values that do exist to other, similar, ones
+            LOGGER.info(f"Not indexing {field} in {layer.name()}, too many values")
+            values = set()
+        values = [
+            v
+            for v in values
+            if not (v is None or (isinstance(v, QVariant) and v.isNull()))
+        ]
+        return ValueIndex(
+            values,
+            labels,
+            # similar numbers are not the same, but labels of numbers can still be matched
+            fuzzy=layer.fields().field(idx).type() == QVariant.String,
+        )
+
+    return VALUE_INDEXES.get(
+        layer, ("values", field, frozenset((labels or {}).items())), build
+    )
+
+
+def resolve_values(
+    layer: QgsVectorLayer,
+    field: str,
+    values: Iterable[Any],
+    labels: Optional[Dict[Any, str]] = None,
+) -> List[Any]:
+    """Replace values by the closest actual values of the field.
+
+    Values that do not match anything are kept, so that the filter still (correctly) returns
+    nothing.
+    """
+
+    if layer.fields().lookupField(field) < 0:
+        return list(values)
+
+    index = value_index(layer, field, labels)
+    result = []
+    for value in values:
+        resolved = index.resolve(value)
+        if not resolved:
+            LOGGER.warning(f"No value of {field} in {layer.name()} matches {value!r}")
+            resolved = [value]
+        elif resolved != [value]:
+            LOGGER.info(
+                f"Resolved {value!r} of {field} in {layer.name()} to {resolved}"
+            )
+        for v in resolved:
+            if v not in result:
+                result.append(v)
+    return result
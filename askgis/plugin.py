@@ -1,4 +1,4 @@
-from typing import Callable, List, Optional
+from typing import TYPE_CHECKING, Callable, List, Optional
 
 from PyQt5.QtCore import Qt
 from qgis.gui import QgisInterface
@@ -6,12 +6,13 @@ from qgis.PyQt.QtCore import QCoreApplication, QTranslator
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QWidget
 
-from askgis.ask_dialog import AskDialog
-from askgis.chat_dock import ChatDock
 from askgis.qgis_plugin_tools.tools.custom_logging import teardown_logger
 from askgis.qgis_plugin_tools.tools.i18n import setup_translation
 from askgis.qgis_plugin_tools.tools.resources import plugin_name
 
+if TYPE_CHECKING:
+    from askgis.chat_dock import ChatDock
+
 
 class Plugin:
     """QGIS Plugin Implementation."""
@@ -33,7 +34,7 @@ class Plugin:
 
         self.actions: List[QAction] = []
         self.menu = Plugin.name
-        self._dock: Optional[ChatDock] = None
+        self._dock: Optional["ChatDock"] = None
 
     def add_action(
         self,
@@ -109,12 +110,17 @@ class Plugin:
             callback=self.run,
             parent=self.iface.mainWindow(),
         )
-        self._dock = ChatDock(self.iface.mainWindow())
-        self.iface.addDockWidget(Qt.RightDockWidgetArea, self._dock)
+        self.add_action(
+            "",
+            text=f"{Plugin.name} chat",
+            callback=self.show_chat,
+            parent=self.iface.mainWindow(),
+        )
 
     def unload(self) -> None:
         """Removes the plugin menu item and icon from QGIS GUI."""
-        self.iface.removeDockWidget(self._dock)
+        if self._dock is not None:
+            self.iface.removeDockWidget(self._dock)
         for action in self.actions:
             self.iface.removePluginMenu(Plugin.name, action)
             self.iface.removeToolBarIcon(action)
@@ -122,4 +128,17 @@ class Plugin:
 
     def run(self) -> None:
         """Run method that performs all the real work"""
+        # the dialogs are imported when first used, to not slow down the start of QGIS
+        from askgis.ask_dialog import AskDialog
+
         AskDialog(self.iface.mainWindow()).exec_()
+
+    def show_chat(self) -> None:
+        """Show the chat dock, it is created the first time it is shown."""
+        if self._dock is None:
+            from askgis.chat_dock import ChatDock
+
+            self._dock = ChatDock(self.iface.mainWindow())
+            self.iface.addDockWidget(Qt.RightDockWidgetArea, self._dock)
+        self._dock.show()
+        self._dock.raise_()
@@ -0,0 +1,114 @@
+from typing import Any, List, Sequence, Tuple
+
+import pytest
+from qgis.core import (
+    QgsCoordinateTransformContext,
+    QgsDataSourceUri,
+    QgsFeature,
+    QgsField,
+    QgsGeometry,
+    QgsProject,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QVariant
+
+CRS = "EPSG:3067"
+"""A metric CRS, so that buffers and distances can be pushed down to the database."""
+
+PARCELS = [
+    (("residential", 1), "POLYGON((0 0, 100 0, 100 100, 0 100, 0 0))"),
+    (("industrial", 2), "POLYGON((200 0, 300 0, 300 100, 200 100, 200 0))"),
+    (("residential", 2), "POLYGON((0 200, 100 200, 100 300, 0 300, 0 200))"),
+    (("park", 1), "POLYGON((400 400, 500 400, 500 500, 400 500, 400 400))"),
+]
+ROADS = [
+    (("main",), "LINESTRING(-50 50, 350 50)"),
+    (("side",), "LINESTRING(50 150, 50 350)"),
+]
+
+
+def memory_layer(
+    name: str,
+    geometry_type: str,
+    fields: Sequence[Tuple[str, QVariant.Type]],
+    features: Sequence[Tuple[Sequence[Any], str]],
+) -> QgsVectorLayer:
+    layer = QgsVectorLayer(f"{geometry_type}?crs={CRS}", name, "memory")
+    layer.dataProvider().addAttributes([QgsField(n, t) for n, t in fields])
+    layer.updateFields()
+    for attributes, wkt in features:
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes(list(attributes))
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        layer.dataProvider().addFeature(feature)
+    return layer
+
+
+def sample_layers() -> List[QgsVectorLayer]:
+    return [
+        memory_layer(
+            "parcels",
+            "Polygon",
+            [("zone", QVariant.String), ("area_class", QVariant.Int)],
+            PARCELS,
+        ),
+        memory_layer("roads", "LineString", [("name", QVariant.String)], ROADS),
+    ]
+
+
+@pytest.fixture()
+def memory_project(qgis_new_project, qgis_processing) -> QgsProject:
+    project = QgsProject.instance()
+    project.addMapLayers(sample_layers())
+    return project
+
+
+def _write(layer: QgsVectorLayer, path: str, driver: str, first: bool) -> None:
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver
+    options.layerName = layer.name()
+    if driver == "SQLite":
+        options.datasourceOptions = ["SPATIALITE=YES"]
+    if not first:
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    result = QgsVectorFileWriter.writeAsVectorFormatV2(
+        layer, path, QgsCoordinateTransformContext(), options
+    )
+    assert result[0] == QgsVectorFileWriter.NoError, result
+
+
+def _database_layer(path: str, name: str, provider: str) -> QgsVectorLayer:
+    if provider == "ogr":
+        layer = QgsVectorLayer(f"{path}|layername={name}", name, provider)
+    else:
+        uri = QgsDataSourceUri()
+        uri.setDatabase(path)
+        uri.setDataSource("", name, "GEOMETRY")
+        layer = QgsVectorLayer(uri.uri(), name, provider)
+    assert layer.isValid(), name
+    return layer
+
+
+@pytest.fixture(params=["GPKG", "SQLite"])
+def database_project(
+    request, tmp_path, qgis_new_project, qgis_processing
+) -> QgsProject:
+    """The sample layers stored in a GeoPackage or a SpatiaLite database."""
+
+    driver = request.param
+    path = str(tmp_path / ("sample.gpkg" if driver == "GPKG" else "sample.sqlite"))
+    layers = sample_layers()
+    for i, layer in enumerate(layers):
+        _write(layer, path, driver, first=i == 0)
+
+    project = QgsProject.instance()
+    project.addMapLayers(
+        [
+            _database_layer(
+                path, layer.name(), "ogr" if driver == "GPKG" else "spatialite"
+            )
+            for layer in layers
+        ]
+    )
+    return project
@@ -0,0 +1,19 @@
+from qgis.core import QgsCoordinateTransformContext, QgsRectangle
+
+from askgis.lib.crs import WGS84, metric_crs
+
+
+def test_metric_crs_of_a_small_extent_is_its_utm_zone():
+    crs = metric_crs(
+        QgsRectangle(24.8, 60.1, 25.1, 60.3), WGS84, QgsCoordinateTransformContext()
+    )
+
+    assert crs.authid() == "EPSG:32635"
+
+
+def test_metric_crs_of_a_global_extent_is_not_a_utm_zone():
+    crs = metric_crs(
+        QgsRectangle(-180, -60, 180, 60), WGS84, QgsCoordinateTransformContext()
+    )
+
+    assert "+proj=aeqd" in crs.toProj()
@@ -0,0 +1,144 @@
+from typing import List, Tuple
+
+import pytest
+from qgis.core import QgsFeature, QgsProcessingFeedback, QgsProject
+
+from askgis.lib import executor
+from askgis.lib.executor import (
+    Action,
+    BufferedLayer,
+    CountAction,
+    DifferenceLayer,
+    Executor,
+    FilteredLayer,
+    IntersectionLayer,
+    Layer,
+    SelectAction,
+    SourceLayer,
+    UnionLayer,
+    WithinDistanceLayer,
+    to_code,
+)
+
+
+def _selected_zones(project: QgsProject, action: Action) -> List[str]:
+    Executor(project, QgsProcessingFeedback()).execute(action)
+    parcels = project.mapLayersByName("parcels")[0]
+    return sorted(feature["zone"] for feature in parcels.selectedFeatures())
+
+
+def test_union_of_one_layer_selects_features_of_both_sides(memory_project):
+    action = SelectAction(
+        UnionLayer(
+            FilteredLayer(SourceLayer("parcels"), "zone", "industrial"),
+            FilteredLayer(SourceLayer("parcels"), "zone", "park"),
+        )
+    )
+
+    assert _selected_zones(memory_project, action) == ["industrial", "park"]
+
+
+def test_union_of_several_layers_selects_features_of_all(memory_project):
+    action = SelectAction(
+        UnionLayer(
+            FilteredLayer(SourceLayer("parcels"), "zone", "industrial"),
+            FilteredLayer(SourceLayer("parcels"), "zone", "park"),
+            FilteredLayer(SourceLayer("parcels"), "area_class", 2),
+        )
+    )
+
+    assert _selected_zones(memory_project, action) == [
+        "industrial",
+        "park",
+        "residential",
+    ]
+
+
+def test_union_of_overlapping_features_selects_features_of_both_sides(
+    memory_project,
+):
+    action = SelectAction(
+        UnionLayer(
+            BufferedLayer(FilteredLayer(SourceLayer("parcels"), "area_class", 2), 350),
+            FilteredLayer(SourceLayer("parcels"), "zone", "park"),
+        )
+    )
+
+    assert _selected_zones(memory_project, action) == [
+        "industrial",
+        "park",
+        "residential",
+    ]
+
+
+def _features(project: QgsProject, layer: Layer) -> List[Tuple[str, float]]:
+    data = Executor(project, QgsProcessingFeedback())._execute_layer(layer)
+    return sorted(
+        (feature["zone"], round(feature.geometry().area(), 3))
+        for feature in data.data.getFeatures(data.request())
+    )
+
+
+@pytest.mark.parametrize(
+    "layer",
+    [
+        IntersectionLayer(
+            SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 20)
+        ),
+        DifferenceLayer(
+            SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 20)
+        ),
+    ],
+    ids=to_code,
+)
+def test_tiled_overlay_has_the_same_features(memory_project, monkeypatch, layer):
+    monkeypatch.setattr(executor, "partition_threshold", lambda: 0)
+    expected = _features(memory_project, layer)
+    # every layer is large enough to be split in tiles
+    monkeypatch.setattr(executor, "partition_threshold", lambda: 1)
+
+    assert _features(memory_project, layer) == expected
+
+
+@pytest.mark.parametrize(
+    "layer",
+    [
+        IntersectionLayer(
+            SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 200)
+        ),
+        IntersectionLayer(SourceLayer("parcels"), SourceLayer("roads")),
+        DifferenceLayer(
+            SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 20)
+        ),
+    ],
+    ids=to_code,
+)
+def test_count_matches_the_features(memory_project, layer):
+    parcels = memory_project.mapLayersByName("parcels")[0]
+    feature = QgsFeature(parcels.fields())
+    feature.setAttributes(["unknown", 3])
+    parcels.dataProvider().addFeatures([feature])
+    count = len(_features(memory_project, layer))
+
+    result = Executor(memory_project, QgsProcessingFeedback()).execute(
+        CountAction(layer)
+    )
+
+    assert result == f"There are {count} matching features"
+
+
+@pytest.mark.parametrize(
+    "distance,zones",
+    [
+        (120, ["industrial", "residential", "residential"]),
+        (360, ["industrial", "park", "residential", "residential"]),
+    ],
+)
+def test_within_distance_selects_features_near_the_target(
+    memory_project, distance, zones
+):
+    action = SelectAction(
+        WithinDistanceLayer(SourceLayer("parcels"), SourceLayer("roads"), distance)
+    )
+
+    assert _selected_zones(memory_project, action) == zones
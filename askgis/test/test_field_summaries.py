@@ -0,0 +1,41 @@
+import time
+
+from askgis.lib import field_summaries
+from askgis.lib.field_summaries import MAX_AGE, _prune
+
+
+def _entry(created: float, path=None, fingerprint_has_time=True) -> dict:
+    return dict(
+        created=created,
+        fingerprint_has_time=fingerprint_has_time,
+        path=path,
+        fields={},
+    )
+
+
+def test_prune_keeps_the_latest_summary_of_existing_layers(tmp_path):
+    data = tmp_path / "parcels.gpkg"
+    data.touch()
+    now = time.time()
+    entries = {
+        f"ogr|{data}|1.0": _entry(now - 10, str(data)),
+        f"ogr|{data}|2.0": _entry(now, str(data)),
+        f"ogr|{tmp_path / 'removed.gpkg'}|1.0": _entry(now, str(tmp_path / "x")),
+        "postgres|dbname='gis'|None": _entry(now, fingerprint_has_time=False),
+        "postgres|dbname='old'|None": _entry(
+            now - MAX_AGE - 1, fingerprint_has_time=False
+        ),
+    }
+
+    assert sorted(_prune(entries)) == [
+        f"ogr|{data}|2.0",
+        "postgres|dbname='gis'|None",
+    ]
+
+
+def test_prune_keeps_the_most_recent_entries(monkeypatch):
+    monkeypatch.setattr(field_summaries, "MAX_ENTRIES", 2)
+    now = time.time()
+    entries = {f"postgres|table{i}|1.0": _entry(now + i) for i in range(4)}
+
+    assert sorted(_prune(entries)) == ["postgres|table2|1.0", "postgres|table3|1.0"]
@@ -0,0 +1,46 @@
+from askgis.lib.executor import (
+    BufferedLayer,
+    CountAction,
+    FilteredLayer,
+    IntersectionLayer,
+    SelectAction,
+    SourceLayer,
+    WithinDistanceLayer,
+)
+from askgis.lib.optimizer import Optimizer
+
+NEAR_ROADS = IntersectionLayer(
+    SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 10)
+)
+
+
+def test_buffer_intersection_becomes_within_distance():
+    action = CountAction(NEAR_ROADS)
+
+    assert Optimizer().optimize(action) == CountAction(
+        WithinDistanceLayer(SourceLayer("parcels"), SourceLayer("roads"), 10)
+    )
+
+
+def test_filters_on_fields_of_a_are_kept_above_within_distance(memory_project):
+    action = SelectAction(FilteredLayer(NEAR_ROADS, "zone", "residential"))
+
+    assert Optimizer().optimize(action, memory_project) == SelectAction(
+        FilteredLayer(
+            WithinDistanceLayer(SourceLayer("parcels"), SourceLayer("roads"), 10),
+            "zone",
+            "residential",
+        )
+    )
+
+
+def test_filters_on_fields_of_b_keep_the_intersection(memory_project):
+    action = SelectAction(FilteredLayer(NEAR_ROADS, "name", "main"))
+
+    assert Optimizer().optimize(action, memory_project) == action
+
+
+def test_filters_are_not_rewritten_without_project():
+    action = SelectAction(FilteredLayer(NEAR_ROADS, "zone", "residential"))
+
+    assert Optimizer().optimize(action) == action
@@ -0,0 +1,150 @@
+from functools import partial
+from typing import Callable, Dict, List, Tuple
+
+import pytest
+from qgis.core import QgsCoordinateReferenceSystem, QgsProcessingFeedback, QgsProject
+
+from askgis.lib.executor import (
+    Action,
+    BufferedLayer,
+    CountAction,
+    DifferenceLayer,
+    Executor,
+    FilteredLayer,
+    IntersectionLayer,
+    MultiValueFilteredLayer,
+    SelectAction,
+    SourceLayer,
+    UnionLayer,
+    WithinDistanceLayer,
+    find_layer,
+    to_code,
+)
+from askgis.lib.sql import DatabaseTable, Relation, SqlCompiler, execute_in_database
+from askgis.test.conftest import CRS
+
+PUSHED_DOWN = [
+    SelectAction(FilteredLayer(SourceLayer("parcels"), "zone", "residential")),
+    SelectAction(
+        MultiValueFilteredLayer(SourceLayer("parcels"), "zone", ("industrial", "park"))
+    ),
+    SelectAction(
+        UnionLayer(
+            FilteredLayer(SourceLayer("parcels"), "area_class", 1),
+            FilteredLayer(SourceLayer("parcels"), "zone", "industrial"),
+        )
+    ),
+    SelectAction(
+        BufferedLayer(FilteredLayer(SourceLayer("roads"), "name", "main"), 25)
+    ),
+    CountAction(FilteredLayer(SourceLayer("parcels"), "area_class", 2)),
+    CountAction(BufferedLayer(SourceLayer("roads"), 10)),
+]
+SPATIAL_JOINS = [
+    SelectAction(IntersectionLayer(SourceLayer("parcels"), SourceLayer("roads"))),
+    CountAction(IntersectionLayer(SourceLayer("parcels"), SourceLayer("roads"))),
+    SelectAction(
+        DifferenceLayer(SourceLayer("parcels"), BufferedLayer(SourceLayer("roads"), 10))
+    ),
+    CountAction(DifferenceLayer(SourceLayer("parcels"), SourceLayer("roads"))),
+    SelectAction(
+        WithinDistanceLayer(SourceLayer("parcels"), SourceLayer("roads"), 120)
+    ),
+]
+
+
+def _execute(
+    project: QgsProject, run: Callable[[Action], str], action: Action
+) -> Tuple[str, Dict[str, List[int]]]:
+    """The result and the selected features of every layer."""
+
+    for layer in project.mapLayers().values():
+        layer.removeSelection()
+    result = run(action)
+    return result, {
+        layer.name(): sorted(layer.selectedFeatureIds())
+        for layer in project.mapLayers().values()
+    }
+
+
+@pytest.mark.parametrize("action", PUSHED_DOWN, ids=to_code)
+def test_pushed_down_plan_matches_executor(database_project, action):
+    executor = Executor(database_project, QgsProcessingFeedback())
+    expected = _execute(database_project, executor.execute, action)
+    actual = _execute(
+        database_project, partial(execute_in_database, database_project), action
+    )
+
+    assert actual == expected
+
+
+@pytest.mark.parametrize("action", SPATIAL_JOINS, ids=to_code)
+def test_spatial_joins_are_left_to_the_executor(database_project, action):
+    assert execute_in_database(database_project, action) is None
+
+
+class PostgisCompiler(SqlCompiler):
+    """Compiles for PostGIS without a database, every layer is a table named after it."""
+
+    def __init__(self, project: QgsProject):
+        super().__init__(project)
+        self._table = DatabaseTable("postgres", "dbname='gis'", "public", "")
+        self._crs = QgsCoordinateReferenceSystem(CRS)
+
+    def _compile_source_layer(self, layer: SourceLayer) -> Relation:
+        original = find_layer(self._project, layer.id)
+        return Relation(
+            f"SELECT * FROM {layer.id}",
+            original.fields().names(),
+            original,
+            original.geometryType(),
+        )
+
+
+TOUCHING_ROADS = (
+    "SELECT 1 FROM (SELECT * FROM roads) AS t1"
+    " WHERE ST_Intersects(t0.__geom, t1.__geom)"
+)
+ROADS_UNION = (
+    "SELECT ST_Union(t2.__geom) FROM (SELECT * FROM roads) AS t2"
+    " WHERE ST_Intersects(t0.__geom, t2.__geom)"
+)
+PARCEL_COLUMNS = 't0."zone", t0."area_class"'
+
+
+@pytest.mark.parametrize(
+    "layer,sql",
+    [
+        (
+            # polygons are kept as they are where they touch lines
+            IntersectionLayer(SourceLayer("parcels"), SourceLayer("roads")),
+            f"SELECT t0.__fid, t0.__geom AS __geom, {PARCEL_COLUMNS}"
+            f" FROM (SELECT * FROM parcels) AS t0 WHERE EXISTS ({TOUCHING_ROADS})",
+        ),
+        (
+            IntersectionLayer(SourceLayer("parcels"), SourceLayer("parcels")),
+            "SELECT t0.__fid, ST_Intersection(t0.__geom, (SELECT ST_Union(t2.__geom)"
+            " FROM (SELECT * FROM parcels) AS t2"
+            f" WHERE ST_Intersects(t0.__geom, t2.__geom))) AS __geom, {PARCEL_COLUMNS}"
+            " FROM (SELECT * FROM parcels) AS t0 WHERE EXISTS (SELECT 1"
+            " FROM (SELECT * FROM parcels) AS t1"
+            " WHERE ST_Intersects(t0.__geom, t1.__geom))",
+        ),
+        (
+            DifferenceLayer(SourceLayer("parcels"), SourceLayer("roads")),
+            f"SELECT * FROM (SELECT t0.__fid, CASE WHEN EXISTS ({TOUCHING_ROADS})"
+            f" THEN ST_Difference(t0.__geom, ({ROADS_UNION})) ELSE t0.__geom END"
+            f" AS __geom, {PARCEL_COLUMNS} FROM (SELECT * FROM parcels) AS t0) AS t3"
+            " WHERE __geom IS NOT NULL AND NOT ST_IsEmpty(__geom)",
+        ),
+        (
+            WithinDistanceLayer(SourceLayer("parcels"), SourceLayer("roads"), 120),
+            "SELECT * FROM (SELECT * FROM parcels) AS t0 WHERE EXISTS (SELECT 1"
+            " FROM (SELECT * FROM roads) AS t1"
+            " WHERE ST_DWithin(t0.__geom, t1.__geom, 120.0))",
+        ),
+    ],
+    ids=["intersection_with_lines", "intersection", "difference", "within_distance"],
+)
+def test_spatial_joins_are_compiled_for_postgis(memory_project, layer, sql):
+    assert PostgisCompiler(memory_project)._compile_layer(layer).sql == sql
@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+from askgis.lib.text_index import fts_query
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("cats dogs", '"cats" "dogs"'),
+        ("cat* OR dogs", '"cat"* OR "dogs"'),
+        ("cats AND NOT dogs", '"cats" "AND" "NOT" "dogs"'),
+        ("cats OR", '"cats"'),
+        ("OR cats", '"cats"'),
+        ("cats OR OR dogs", '"cats" OR "dogs"'),
+        ("OR", ""),
+    ],
+)
+def test_fts_query(query, expected):
+    assert fts_query(query) == expected
+
+
+@pytest.mark.parametrize("query", ["cats OR", "OR", "AND", "NOT", "cats NOT", "OR *"])
+def test_fts_query_is_valid(query):
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE VIRTUAL TABLE documents USING fts5(text)")
+    connection.execute("INSERT INTO documents VALUES ('cats and dogs')")
+    match = fts_query(query)
+    if match:
+        connection.execute(
+            "SELECT rowid FROM documents WHERE documents MATCH ?", (match,)
+        ).fetchall()
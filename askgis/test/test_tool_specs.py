@@ -0,0 +1,158 @@
+import json
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import pytest
+from langchain.llms.base import LLM
+
+from askgis.lib import tool_specs
+from askgis.lib.tool_specs import ToolSpecCache, load_plugin_tools
+
+MANIFEST = dict(
+    schema_version="v1",
+    name_for_model="parcels",
+    name_for_human="Parcels",
+    description_for_model="Finds parcels.",
+    description_for_human="Finds parcels.",
+    auth=dict(type="none"),
+    api=dict(type="openapi", url="openapi.json"),
+    logo_url="https://example.com/logo.png",
+    contact_email="gis@example.com",
+    legal_info_url="https://example.com/legal",
+)
+SPEC = {
+    "openapi": "3.0.1",
+    "info": {"title": "Parcels", "version": "1.0"},
+    "servers": [{"url": "https://example.com"}],
+    "paths": {
+        "/parcels": {
+            "get": {
+                "operationId": "getParcels",
+                "summary": "Parcels in a zone",
+                "parameters": [
+                    {
+                        "name": "zone",
+                        "in": "query",
+                        "required": True,
+                        "schema": {"type": "string"},
+                    }
+                ],
+                "responses": {"200": {"description": "The parcels"}},
+            }
+        }
+    },
+}
+URL = "https://example.com/openapi.json"
+TTL = 60
+
+
+class FakeLLM(LLM):
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        return ""
+
+
+class FakeServer:
+    """Serves a body with an ETag, answering conditional requests for it with 304."""
+
+    def __init__(self):
+        self.body = json.dumps(SPEC)
+        self.etag = '"v1"'
+        self.requests: List[Dict[str, str]] = []
+
+    def get(self, url: str, headers: Dict[str, str], timeout: float):
+        self.requests.append(headers)
+        if headers.get("If-None-Match") == self.etag:
+            return self._response(304, "", {})
+        return self._response(200, self.body, {"ETag": self.etag})
+
+    @staticmethod
+    def _response(status_code: int, text: str, headers: Dict[str, str]):
+        return SimpleNamespace(
+            status_code=status_code,
+            text=text,
+            headers=headers,
+            raise_for_status=lambda: None,
+        )
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def server(monkeypatch) -> FakeServer:
+    server = FakeServer()
+    monkeypatch.setattr(tool_specs.requests, "get", server.get)
+    return server
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(tool_specs.time, "time", clock)
+    return clock
+
+
+def _wait_for_revalidation(cache: ToolSpecCache) -> None:
+    for thread in list(cache._revalidating.values()):
+        thread.join()
+
+
+def test_plugin_tools_are_loaded_from_local_files(tmp_path, server):
+    (tmp_path / "ai-plugin.json").write_text(json.dumps(MANIFEST), encoding="utf-8")
+    (tmp_path / "openapi.json").write_text(json.dumps(SPEC), encoding="utf-8")
+
+    tools = load_plugin_tools(
+        FakeLLM(),
+        str(tmp_path / "ai-plugin.json"),
+        ToolSpecCache(str(tmp_path / "cache"), TTL),
+    )
+
+    assert [tool.name.split(".")[-1] for tool in tools] == ["getParcels"]
+    assert server.requests == []
+
+
+def test_cached_spec_is_used_within_the_ttl(tmp_path, server, clock):
+    cache = ToolSpecCache(str(tmp_path), TTL)
+    body = cache.get(URL)
+    server.body = "changed"
+    clock.now += TTL - 1
+
+    assert cache.get(URL) == body
+    assert server.requests == [{}]
+
+
+def test_expired_spec_is_revalidated_with_its_etag(tmp_path, server, clock):
+    cache = ToolSpecCache(str(tmp_path), TTL)
+    body = cache.get(URL)
+    clock.now += TTL + 1
+
+    # the cached spec is returned right away, while it is revalidated
+    assert cache.get(URL) == body
+    _wait_for_revalidation(cache)
+    assert server.requests == [{}, {"If-None-Match": '"v1"'}]
+
+    # not modified, so the spec is kept and only revalidated again after the TTL
+    clock.now += TTL - 1
+    assert cache.get(URL) == body
+    assert len(server.requests) == 2
+
+
+def test_modified_spec_replaces_the_cached_one(tmp_path, server, clock):
+    cache = ToolSpecCache(str(tmp_path), TTL)
+    body = cache.get(URL)
+    server.body, server.etag = "changed", '"v2"'
+    clock.now += TTL + 1
+
+    assert cache.get(URL) == body
+    _wait_for_revalidation(cache)
+    assert cache.get(URL) == "changed"
+    assert ToolSpecCache(str(tmp_path), TTL).get(URL) == "changed"
@@ -0,0 +1,103 @@
+"""Measure how long it takes QGIS to load the plugin, and check that it stays fast.
+
+Run it with a Python interpreter that is able to import qgis (e.g. python-qgis.bat on
+Windows) from the root of the repository:
+
+    python benchmarks/import_time.py --budget-ms 200
+
+Exits with a non-zero status if loading the plugin imports any of the modules that must only
+be imported on the first question, or if it takes longer than the budget.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLUGIN_MODULE = "askgis.plugin"
+DEFERRED_MODULES = ("langchain", "openai", "tiktoken", "askgis.lib.chain")
+
+# qgis is already loaded when QGIS loads a plugin, so it is not part of the measurement
+PRELUDE = "import qgis.core, qgis.gui, qgis.PyQt.QtWidgets"
+
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def measure() -> Tuple[float, Dict[str, int]]:
+    """Import the plugin in a fresh interpreter, returns its time (ms) and all imported modules."""
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"{PRELUDE}\nimport {PLUGIN_MODULE}\n{PLUGIN_MODULE}.Plugin",
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {PLUGIN_MODULE}:\n{result.stderr}")
+
+    total_us = 0
+    modules: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match is None:
+            continue
+        cumulative, indent, module = int(match[2]), len(match[3]), match[4]
+        modules[module] = cumulative
+        # everything else the plugin imports is nested below these
+        if indent == 1 and module.split(".")[0] == "askgis":
+            total_us += cumulative
+    return total_us / 1000, modules
+
+
+def slowest(modules: Dict[str, int], count: int) -> List[Tuple[str, int]]:
+    return sorted(
+        ((m, us) for m, us in modules.items() if m.startswith("askgis")),
+        key=lambda item: -item[1],
+    )[:count]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = []
+    modules: Dict[str, int] = {}
+    for _ in range(args.repeat):
+        elapsed, modules = measure()
+        timings.append(elapsed)
+    median = statistics.median(timings)
+
+    print(f"Importing {PLUGIN_MODULE}: {median:.1f} ms (median of {args.repeat})")
+    for module, us in slowest(modules, 10):
+        print(f"  {us / 1000:8.1f} ms  {module}")
+
+    failed = False
+    imported = sorted(
+        m
+        for m in modules
+        if any(m == d or m.startswith(f"{d}.") for d in DEFERRED_MODULES)
+    )
+    if imported:
+        print(f"FAIL: imported at startup: {', '.join(imported)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: above the budget of {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())